@@ -6,61 +6,19 @@ import pymongo
 import datetime
 from pprint import pprint
 import pandas as pd
-import re
-import copy
-from thefuzz import process
 from pathlib import Path
 from datetime import datetime
 import argparse
 from itertools import chain
 from utils.gsheets import WGSTracking
 from utils.gdrive import CCGPDrive
+from utils.ncbi import explode_read_pairs, fill_geo_loc_name
 
 
 def preprocess_dataframe(df: pd.DataFrame) -> pd.DataFrame:
     """Processes dataframe from MongoDB to be turned into workflow sheet or SRA sheet."""
-    list_of_dicts = []
-    for _, row in df.iterrows():
-        record = row.to_dict()
-        try:
-            files = sorted(record["files"])
-
-            if len(files) == 2:
-                record["filename"] = files[0]
-                record["filename2"] = files[1]
-                record["library_ID"] = record["filename"].split("_R1")[0]
-                record["title"] = f"Whole genome sequencing of {record['*organism']}"
-                list_of_dicts.append(record)
-
-            elif len(files) >= 4:
-
-                prefixes = set()
-                for file in files:
-                    prefixes.add(
-                        re.split("_R\d[._]", file)[0]
-                    )  # this splits on the _R1/R2 of the filename
-
-                # Using fuzzy matching here for the following example case:
-                # sample has two sets of reads: samp_a1_R1.fq.gz and samp_a1_L001_R1.fq.gz
-                # Splitting on R1 gives two prefixes, samp_a1_R1 and samp_a1_L001, the former is a substring of the latter,
-                # So something like [f for f in files if p in f for p in prefixes] doesn't work to find pairs of reads.
-                pairs = []
-                for p in prefixes:
-                    matches = process.extract(p, files, limit=2)
-                    pairs.append([matches[0][0], matches[1][0]])
-
-                for pair in pairs:
-                    record_copy = copy.deepcopy(record)
-                    record_copy["filename"] = pair[0]
-                    record_copy["filename2"] = pair[1]
-                    record_copy["library_ID"] = record_copy["filename"].split("_R1")[0]
-                    record_copy[
-                        "title"
-                    ] = f"Whole genome sequencing of {record_copy['*organism']}"
-                    list_of_dicts.append(record_copy)
-        except TypeError:
-            continue
-    out_df = pd.DataFrame(list_of_dicts)
+    out_df = explode_read_pairs(df)
+    out_df["title"] = "Whole genome sequencing of " + out_df["*organism"].astype(str)
     return out_df
 
 
@@ -183,6 +141,8 @@ def create_biosample_sheet(project_id: str, db_client: pymongo.MongoClient) -> N
     if "Preferred Sequence ID" in df.columns:
         df = df.rename(columns={"Preferred Sequence ID": "sample_title"})
 
+    fill_geo_loc_name(df)
+
     df["lat_lon"] = df["lat"].astype(str) + "," + df["long"].astype(str)
 
     df["isolate"] = (
@@ -200,7 +160,7 @@ def create_biosample_sheet(project_id: str, db_client: pymongo.MongoClient) -> N
         "cultivar",
         "ecotype",
         "age",
-        "*gen_loc_name",
+        "*geo_loc_name",
         "*tissue",
         "biomaterial_provider",
         "cell_line",
@@ -283,7 +243,7 @@ def create_biosample_sheet(project_id: str, db_client: pymongo.MongoClient) -> N
         "disease",
         "disease_stage",
         "genotype",
-        "geo_loc_name",
+        "*geo_loc_name",
         "growth_protocol",
         "health_state",
         "isolation_source",
@@ -34,6 +34,7 @@ from thefuzz import process
 import copy
 from utils.db import get_mongo_client
 from geopy.geocoders import Nominatim
+from utils.ncbi import fill_geo_loc_name, fill_sample_title
 from colorama import Fore, Style
 import math
 
@@ -266,34 +267,8 @@ def generate_TSV(get_project_metadata, data_collection_bin, all_project_fields,
 
     if sheet_type == "biosample":  # Handles filling out necessary columns with data and TSV generation for the 'biosample' sheet_type.
 
-        for i, row in df.iterrows(): # Loop through each row of the Pandas DataFrame.
-            if (pd.isnull(row["*geo_loc_name"]) or row["*geo_loc_name"] == "") and (pd.isnull(row["Locality Description"]) or row["Locality Description"] == ""):
-                #df.at[i, "*geo_loc_name"] = 'not provided'
-                county_name = df.loc[i, "County"]
-                state_name = df.loc[i, "State"]
-                if (pd.isnull(row["County"]) or row["County"] == "") and (pd.isnull(row["State"]) or row["State"] == ""):
-                    df.at[i, "*geo_loc_name"] = "missing"
-                elif (pd.isnull(row["County"]) or row["County"] == "") and (row["County"]):
-                     df.at[i, "*geo_loc_name"] = "USA: " + str(state_name) 
-                elif (pd.isnull(row["State"]) or row["State"] == "") and (row["County"]): # NOT SURE ABOUT THIS.
-                    df.at[i, "*geo_loc_name"] = "missing"
-                elif (row["County"]) and (row["County"]):
-                    df.at[i, "*geo_loc_name"] = "USA: " + str(state_name) + ": " + str(county_name)
-
-            
-            elif (row["*geo_loc_name"]) and (pd.isnull(row["Locality Description"]) or row["Locality Description"] == ""):
-                df.at[i, "*geo_loc_name"] = df.loc[i, "*geo_loc_name"]
-            
-            elif (pd.isnull(row["*geo_loc_name"]) or row["*geo_loc_name"] == "") and (row["Locality Description"]):
-                df.at[i, "*geo_loc_name"] = df.loc[i, "Locality Description"]
-            
-            elif row["*geo_loc_name"] and row["Locality Description"]:
-                geo_name = df.loc[i, "*geo_loc_name"]
-                loc_description = df.loc[i, "Locality Description"]
-                df.at[i, "*geo_loc_name"] = geo_name + ":" + loc_description
-
-            if pd.isnull(row["sample_title"]) or row["sample_title"] == "":
-                df.at[i, "sample_title"] = row["minicore_seq_id"]
+        fill_geo_loc_name(df)  # Falls back on Locality Description, then State/County.
+        fill_sample_title(df)
 
         for col in required_columns: # Loop through each required folumn and replace blanks with "missing".
             if col not in df.columns:
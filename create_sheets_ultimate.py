@@ -10,10 +10,16 @@ Arguments:
 Example of Command Line:
     python3 create_sheets_TEST.py {project-id} {taxon} {sheet-type}
     python3 create_sheets_TEST.py 41-Thomomys vertebrate sra
+
+Batch mode (many projects/sheets in one run; entries and manifest files can be mixed):
+    python3 create_sheets_ultimate.py --batch 41-Thomomys:vertebrate:sra 41-Thomomys:vertebrate:biosample
+    python3 create_sheets_ultimate.py --batch submission_round.txt --workers 8
 """
 
 import os
 import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pymongo
 import pandas as pd
 import gspread
@@ -21,24 +27,25 @@ import traceback
 import itertools
 import numpy as np
 import re
-from thefuzz import process
-import copy
-from utils.db import get_mongo_client
+from utils.db import get_collections
 from geopy.geocoders import Nominatim
+from utils.ncbi import explode_read_pairs, fill_geo_loc_name, fill_sample_title
+from utils.boundaries import BoundaryResolver
+from utils.geocode import CachedLocation, CachedReverseGeocoder
 from colorama import Fore, Style
 import math
 
 dim = "\033[2m"
+COORD_FIELDS = {"_id": 0, "*sample_name": 1, "lat": 1, "long": 1, "protected_coords": 1, "exclude": 1, "township": 1, "range": 1, "section": 1}
+
+
 def Connect_MongoDB():
     """
     Method connects to MongoDB client and returns the sample_metadata collection.
     """
-    client = get_mongo_client()
-    db = client["ccgp_dev"]
-    collection = db["sample_metadata"]
-    reads_collection = db["reads"]
+    collections = get_collections()
 
-    return collection, reads_collection
+    return collections.sample_metadata, collections.reads
 
 
 def Identify_Fields(collection):
@@ -70,15 +77,32 @@ def biosample_check_if_uploaded(df_data):
     return df_data, new_sample_counter
 
 
-def sra_check_if_uploaded(df, reads_collection):
+def fetch_reads_by_name(reads_collection, file_names, batch_size=5000):
+    """
+    Fetches the "reads" documents for file_names with batched $in queries and returns them keyed by file_name.
+    """
+    file_names = list(dict.fromkeys(file_names))
+    projection = {"_id": 0, "file_name": 1, "instrument_model": 1, "uploaded_to_NCBI": 1}
+    reads_by_name = {}
+    for i in range(0, len(file_names), batch_size):
+        query = {"file_name": {"$in": file_names[i : i + batch_size]}}
+        for document in reads_collection.find(query, projection):
+            reads_by_name[document["file_name"]] = document
+    return reads_by_name
+
+
+def sra_check_if_uploaded(df, reads_collection, reads_by_name=None):
     """
     Checks Mongo "reads" collection to see if the file has already been uploaded to NCBI or not.
     """
 
+    if reads_by_name is None:
+        reads_by_name = fetch_reads_by_name(reads_collection, df["filename"].dropna())
+
     not_uploaded_counter = 0
     for i, row in df.iterrows():
         filename = row["filename"]
-        query_result = reads_collection.find_one({'file_name': filename})
+        query_result = reads_by_name.get(filename)
 
         if query_result and query_result.get('uploaded_to_NCBI') == 'yes':
             df.drop(i, inplace=True)
@@ -88,15 +112,11 @@ def sra_check_if_uploaded(df, reads_collection):
     return df, not_uploaded_counter
 
 
-def Write_Metadata(collection, all_project_fields, project_name, data_type, sheet_type):
+def metadata_fields(data_type, sheet_type):
     """
-    Method collects all metadata (fields and values) from MongoDB and organizes them based on data_type and sheet_type.
+    Returns the MongoDB projection (data_collection_bin) of the fields needed for data_type and sheet_type.
     Different fields are required for each data_type for 'biosample' sheet_type; Same fields used for all data_type's for 'sra' sheet_type.
     """
-    query = {"ccgp-project-id": project_name}
-    project_id = query["ccgp-project-id"]
-
-    mongoDB_fields = all_project_fields
     data_collection_bin = {}
 
     if (sheet_type == "biosample"):  # Checks to see if sheet_type argument is biosample. If true, creates a biosample sheet csv.
@@ -264,8 +284,23 @@ def Write_Metadata(collection, all_project_fields, project_name, data_type, shee
             }
     else:
         raise ValueError("Invalid sheet type input. Valid sheet type inputs include: biosample, sra")
-    
-    num_documents = collection.count_documents(query)  # Fetches # of samples with metadata in ccgp-project-id of interest.
+
+    return data_collection_bin
+
+
+def Write_Metadata(collection, all_project_fields, project_name, data_type, sheet_type, num_documents=None):
+    """
+    Method collects all metadata (fields and values) from MongoDB and organizes them based on data_type and sheet_type.
+    num_documents is the sample count to report; it is counted in MongoDB when not given (batch mode already has the documents).
+    """
+    query = {"ccgp-project-id": project_name}
+    project_id = query["ccgp-project-id"]
+
+    mongoDB_fields = all_project_fields
+    data_collection_bin = metadata_fields(data_type, sheet_type)
+
+    if num_documents is None:
+        num_documents = collection.count_documents(query)  # Fetches # of samples with metadata in ccgp-project-id of interest.
     print('')
     print(dim + Fore.YELLOW + '_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_' + Style.RESET_ALL)
     print(dim + Fore.BLUE+'         ~ MetaData Information ~'+ Style.RESET_ALL)
@@ -277,9 +312,10 @@ def Write_Metadata(collection, all_project_fields, project_name, data_type, shee
     return collection.find(query, data_collection_bin), data_collection_bin, project_id
 
 
-def generate_TSV(get_project_metadata, data_collection_bin, all_project_fields, project_name, sheet_type, collection, reads_collection):
+def generate_TSV(get_project_metadata, data_collection_bin, all_project_fields, project_name, sheet_type, collection, reads_collection, reads_by_name=None):
     """
     Method fetches data from MongoDB for both biosample and sra, biosample sample_names sent to gsheets_TEST.py to get coordinate info. SRA sheet generation happens here.
+    reads_by_name (from fetch_reads_by_name) can be passed in to skip the reads lookup, e.g. when it is shared across projects.
     """
 
     df = pd.DataFrame(get_project_metadata)  # Creates a data frame.
@@ -292,34 +328,8 @@ def generate_TSV(get_project_metadata, data_collection_bin, all_project_fields,
         #df = df[df['files'].apply(len) != 0]
         df = df[df['files'].notna()]  # Remove rows where 'files' column is NaN
         df = df[df['files'].apply(lambda x: isinstance(x, list) and len(x) != 0)]  
-        for i, row in df.iterrows(): # Loop through each row of the Pandas DataFrame.
-            if (pd.isnull(row["*geo_loc_name"]) or row["*geo_loc_name"] == "") and (pd.isnull(row["Locality Description"]) or row["Locality Description"] == ""):
-                #df.at[i, "*geo_loc_name"] = 'not provided'
-                county_name = df.loc[i, "County"]
-                state_name = df.loc[i, "State"]
-                if (pd.isnull(row["County"]) or row["County"] == "") and (pd.isnull(row["State"]) or row["State"] == ""):
-                    df.at[i, "*geo_loc_name"] = "missing"
-                elif (pd.isnull(row["County"]) or row["County"] == "") and (row["County"]):
-                     df.at[i, "*geo_loc_name"] = "USA: " + str(state_name) 
-                elif (pd.isnull(row["State"]) or row["State"] == "") and (row["County"]): # NOT SURE ABOUT THIS.
-                    df.at[i, "*geo_loc_name"] = "missing"
-                elif (row["County"]) and (row["County"]):
-                    df.at[i, "*geo_loc_name"] = "USA: " + str(state_name) + ": " + str(county_name)
-
-            
-            elif (row["*geo_loc_name"]) and (pd.isnull(row["Locality Description"]) or row["Locality Description"] == ""):
-                df.at[i, "*geo_loc_name"] = df.loc[i, "*geo_loc_name"]
-            
-            elif (pd.isnull(row["*geo_loc_name"]) or row["*geo_loc_name"] == "") and (row["Locality Description"]):
-                df.at[i, "*geo_loc_name"] = df.loc[i, "Locality Description"]
-            
-            elif row["*geo_loc_name"] and row["Locality Description"]:
-                geo_name = df.loc[i, "*geo_loc_name"]
-                loc_description = df.loc[i, "Locality Description"]
-                df.at[i, "*geo_loc_name"] = geo_name + ":" + loc_description
-
-            if pd.isnull(row["sample_title"]) or row["sample_title"] == "":
-                df.at[i, "sample_title"] = row["minicore_seq_id"]
+        fill_geo_loc_name(df)  # Falls back on Locality Description, then State/County.
+        fill_sample_title(df)
 
         for col in required_columns: # Loop through each required folumn and replace blanks with "missing".
             if col not in df.columns:
@@ -356,9 +366,9 @@ def generate_TSV(get_project_metadata, data_collection_bin, all_project_fields,
 
     elif sheet_type == "sra":  # Handles filling out necessary columns with data and TSV generation for the 'sra' sheet_type.
 
-        client_reads = get_mongo_client()
-        db_r = client_reads["ccgp_dev"]
-        collection_reads = db_r["reads"]
+        if reads_by_name is None:  # One batched lookup for every file in the project instead of a find_one per R1 file.
+            project_files = [file for files in df["files"] if isinstance(files, list) for file in files]
+            reads_by_name = fetch_reads_by_name(reads_collection, project_files)
 
         for i, row in df.iterrows(): # Loop through each row of the Pandas DataFrame.
             if (pd.isnull(row["library_prep_method"]) or row["library_prep_method"] == ""):
@@ -384,46 +394,17 @@ def generate_TSV(get_project_metadata, data_collection_bin, all_project_fields,
             else:
                 df[field] = default_value
 
-        highest_len_files = 0 # Counter to maintain the most amount of files representing a single sample from the project.
-        list_of_dicts = []
-        i = 0
+        highest_len_files = df["files"].map(lambda files: len(files) if isinstance(files, list) else 0).max() # Most files representing a single sample from the project.
         match_count = 0
-        for _, row in df.iterrows():
-            record = row.to_dict()
-            try:
-                files = sorted(record["files"])
-                i += 1
-
-                if len(files) % 2 == 0:
-                    for j in range(0, len(files), 2):
-                        record_copy = copy.deepcopy(record)
-                        record_copy["filename"] = files[j]
-                        #print(record_copy["filename"])
-                        record_copy["filename2"] = files[j + 1]
-                        #print(record_copy["filename2"])
-                        #print('')
-                        record_copy["library_ID"] = files[j].split("_R1")[0]
-                        record_copy["title"] = f"Whole genome sequencing of {record_copy['*organism']}"
-
-                        document_test = collection_reads.find_one({"file_name": files[j]})
-                        # print(document_test)
-                        # print('')
-                        if document_test and "instrument_model" in document_test:
-                # Replace the value in your DataFrame with the default instrument value
-                            record_copy['instrument_model'] = document_test["instrument_model"]
-
-                        list_of_dicts.append(record_copy)
-                        len_files = len(files)
-
-                        if len_files > highest_len_files:
-                            highest_len_files = len_files
-
-            except TypeError:
-                continue
-        
-        out_df = pd.DataFrame(list_of_dicts)
+        out_df = explode_read_pairs(df)  # One row per R1/R2 pair, paired on the _R1/_R2 token.
+        out_df["title"] = "Whole genome sequencing of " + out_df["*organism"].astype(str)
+        # Take the instrument model from the R1 reads document where there is one.
+        out_df["instrument_model"] = [
+            (reads_by_name.get(file_name) or {}).get("instrument_model", default_model)
+            for file_name, default_model in zip(out_df["filename"], out_df["instrument_model"])
+        ]
         print('')
-        print(f'# of Files = {len_files}')
+        print(f'# of Files = {highest_len_files}')
         print(f'HIGHEST # of Lanes = {match_count}')
         print('')
 
@@ -437,7 +418,7 @@ def generate_TSV(get_project_metadata, data_collection_bin, all_project_fields,
         df.rename(columns={"*sample_name": "sample_name"}, inplace=True)
 
 
-        out_df, not_uploaded_counter = sra_check_if_uploaded(out_df, reads_collection)
+        out_df, not_uploaded_counter = sra_check_if_uploaded(out_df, reads_collection, reads_by_name)
         out_df.rename(columns={"ncbi_accession_id": "biosample_accession"}, inplace=True)
 
         output_folder = "sra_sheets_extra"
@@ -449,77 +430,74 @@ def generate_TSV(get_project_metadata, data_collection_bin, all_project_fields,
     print(f"Number of rows in DataFrame for {project_name} ({sheet_type}): {len(df)}")  # Debug print statement. DataFrames should = # of samples.
     print(f'Number of rows in this sheet {not_uploaded_counter}')
 
+def _flag(values):
+    """Upper-cased protected_coords/exclude flags as strings, '' where missing."""
+    return np.where(pd.isna(values), "", values.map(lambda v: str(v).upper()))
+
+
+def apply_coord_info(all_proj_data_bin, coord_info, grab_loc_data):
+    """
+    Fills "lat_lon" and "*geo_loc_name" in place from each sample's coordinate info, all rows at once.
+
+    protected & exclude        -> lat_lon is "not provided"
+    protected & not exclude    -> *geo_loc_name is "<Country:State>, township-range-section"
+    unprotected (or no flags)  -> lat_lon is "lat,long" and *geo_loc_name is "<Country:State>", followed by
+                                  ", <existing *geo_loc_name>" unless that was empty or "missing".
+    """
+    if not coord_info:
+        return
+    samples = list(coord_info)
+    fields = ["protected_coords_check", "exclude_check", "lat_value", "long_value", "township", "range", "section"]
+    coords = pd.DataFrame(
+        {field: pd.Series([coord_info[s][field] for s in samples], index=samples, dtype=object) for field in fields}
+    )  # Kept as python objects so str() of each value matches the per-sample code this replaced.
+    coords["geo_loc"] = pd.Series([grab_loc_data[s] for s in samples], index=samples, dtype=object)
+
+    sample_names = all_proj_data_bin["*sample_name"]
+    rows = coords.reindex(sample_names.values)  # One row of coordinate info per sample row.
+    in_coords = sample_names.isin(coords.index).values
+    protected = _flag(rows["protected_coords_check"])
+    exclude = _flag(rows["exclude_check"])
+    # Like the per-sample lookups this replaces, the existing geo_loc_name is taken from a sample's first row.
+    first_rows = all_proj_data_bin.drop_duplicates("*sample_name").set_index("*sample_name")
+    existing = sample_names.map(first_rows["*geo_loc_name"]).values
+
+    geo_loc = rows["geo_loc"].map(str).values
+    hidden = in_coords & (protected == "TRUE") & (exclude == "TRUE")
+    township = in_coords & (protected == "TRUE") & (exclude == "FALSE")
+    unprotected = in_coords & (
+        ((protected == "FALSE") & (exclude == "FALSE"))
+        | ((protected == "NAN") & (exclude == "NAN"))
+        | ((protected == "") & (exclude == ""))
+    )
+    lat_missing = (rows["lat_value"] == "NaN").values & (rows["long_value"] == "NaN").values
+    lat_long_string = np.where(
+        lat_missing, "not provided", (rows["lat_value"].map(str) + "," + rows["long_value"].map(str)).values
+    )
+    township_geo_loc = (
+        rows["geo_loc"].map(str) + ", " + rows["township"].map(str) + "-" + rows["range"].map(str) + "-" + rows["section"].map(str)
+    ).values  # output = USA:[state], township-range-section
+    keep_existing = (
+        unprotected
+        & np.array([bool(v) for v in existing], dtype=bool)
+        & (geo_loc != "not provided")
+        & (existing != "missing")
+    )
+    with_existing = np.where(keep_existing, geo_loc + ", " + np.where(keep_existing, existing, "").astype(object), geo_loc)
+
+    all_proj_data_bin["lat_lon"] = np.select(
+        [hidden, unprotected], [np.full(len(rows), "not provided", dtype=object), lat_long_string], default=all_proj_data_bin["lat_lon"].values
+    )
+    all_proj_data_bin["*geo_loc_name"] = np.select(
+        [township, unprotected], [township_geo_loc, with_existing], default=all_proj_data_bin["*geo_loc_name"].values
+    )
+
+
 def create_biosample_TSV(get_project_metadata, data_collection_bin, all_project_fields, project_name, sheet_type, df_data, all_proj_data_bin, coord_info, grab_loc_data, collection):
     
     if sheet_type == "biosample":  # Handles filling out necessary columns with data and TSV generation for the 'biosample' sheet_type.
         
-        for sample_name, info in coord_info.items():
-            protected_coords_check = info["protected_coords_check"]
-            exclude_check = info["exclude_check"]
-            lat_value = info["lat_value"]
-            long_value = info["long_value"]
-            township_value = info["township"]
-            range_value = info["range"]
-            section_value = info["section"]
-
-            protected_coords_check = str(protected_coords_check).upper() if not pd.isna(protected_coords_check) else ''
-            exclude_check = str(exclude_check).upper() if not pd.isna(exclude_check) else ''
-            # if not math.isnan(protected_coords_check) and not math.isnan(exclude_check):
-            #     protected_coords_check = str(protected_coords_check).upper()
-            #     exclude_check = str(exclude_check).upper()
-            # else:
-            #     protected_coords_check = ''
-            #     exclude_check = ''
-
-            if protected_coords_check == "TRUE" and exclude_check == "TRUE":
-                all_proj_data_bin.loc[all_proj_data_bin["*sample_name"] == sample_name, "lat_lon"] = "not provided"
-
-            elif protected_coords_check == "TRUE" and exclude_check == "FALSE":
-                cali = 'USA:California,'
-           
-                geo_loc = str(grab_loc_data[sample_name]) + ', ' + str(township_value) + '-' + str(range_value) + '-' + str(section_value) #output = USA:[state], township-range-section
-                # print(geo_loc)
-                # geo_loc = str(township_value) + '-' + str(range_value) + '-' + str(section_value) #output = township-range-section
-                # print(geo_loc)
-                # print('')
-
-                existing_geo_loc = all_proj_data_bin.loc[all_proj_data_bin["*sample_name"] == sample_name, "*geo_loc_name"].values[0] # maybe delete this if glitch.
-                #print(f'1: {existing_geo_loc}')
-                if existing_geo_loc and geo_loc != "not provided": # maybe delete this if glitch.
-                    print("existing geo loc is true")
-                    all_proj_data_bin.loc[all_proj_data_bin["*sample_name"] == sample_name, ["*geo_loc_name"]] = geo_loc # maybe delete this if glitch.
-                else: # maybe delete this if glitch.
-                    all_proj_data_bin.loc[all_proj_data_bin["*sample_name"] == sample_name, ["*geo_loc_name"]] = geo_loc # maybe delete this if glitch.
-                print('')
-
-            elif (protected_coords_check == "FALSE" and exclude_check == "FALSE") or (protected_coords_check == "NAN" and exclude_check == "NAN") or (not protected_coords_check and not exclude_check):
-            # rest of your code
-
-                #print(f' {lat_value}, {long_value}')
-                if lat_value == "NaN" and long_value == "NaN":
-                    lat_long_string = "not provided"
-                else:
-                    lat_long_string = str(lat_value) + ',' + str(long_value)
-
-                geo_loc = str(grab_loc_data[sample_name]) # This grabs the USA:California stuff.
-                #print(geo_loc) 
-                
-                
-                existing_geo_loc = all_proj_data_bin.loc[all_proj_data_bin["*sample_name"] == sample_name, "*geo_loc_name"].values[0]
-                #print(f'2: {existing_geo_loc}')
-                if existing_geo_loc and geo_loc != "not provided":
-                    if existing_geo_loc == "missing":
-                        all_proj_data_bin.loc[all_proj_data_bin["*sample_name"] == sample_name, ["lat_lon"]] = lat_long_string
-                        all_proj_data_bin.loc[all_proj_data_bin["*sample_name"] == sample_name, ["*geo_loc_name"]] = geo_loc
-                    else:
-                        all_proj_data_bin.loc[all_proj_data_bin["*sample_name"] == sample_name, ["lat_lon"]] = lat_long_string
-                        all_proj_data_bin.loc[all_proj_data_bin["*sample_name"] == sample_name, ["*geo_loc_name"]] = geo_loc + ', ' + existing_geo_loc # This is USA:California, Locality Description
-                        #all_proj_data_bin.loc[all_proj_data_bin["*sample_name"] == sample_name, ["*geo_loc_name"]] = existing_geo_loc # This is just Locality Description.
-                else:
-                    all_proj_data_bin.loc[all_proj_data_bin["*sample_name"] == sample_name, ["lat_lon"]] = lat_long_string
-                    all_proj_data_bin.loc[all_proj_data_bin["*sample_name"] == sample_name, ["*geo_loc_name"]] = geo_loc
-        
-
+        apply_coord_info(all_proj_data_bin, coord_info, grab_loc_data)
 
         df_data, bio_counter = biosample_check_if_uploaded(df_data)
 
@@ -532,7 +510,11 @@ def create_biosample_TSV(get_project_metadata, data_collection_bin, all_project_
         df_data.to_csv(output_path, sep="\t", index=False)
         print(f'Number of rows in this sheet {bio_counter}')
 
-def google_sheets(df_data, sample_names_to_compare, sheet_type, project_id):
+def google_sheets(df_data, sample_names_to_compare, sheet_type, project_id, coord_documents=None):
+    """
+    Collects each sample's coordinates and protection flags. coord_documents are the project's sample_metadata
+    documents if they were already fetched (batch mode); otherwise they are queried here.
+    """
     proj_sampleNames_bin = sample_names_to_compare
     all_proj_data_bin = df_data
     coord_info = {}
@@ -540,16 +522,14 @@ def google_sheets(df_data, sample_names_to_compare, sheet_type, project_id):
 
     if sheet_type == "biosample":
 
-        client = get_mongo_client()
-        db = client['ccgp_dev']
-        collection = db['sample_metadata']
-
+        if coord_documents is None:
+            collection = get_collections().sample_metadata
 
-        query = {"ccgp-project-id": project_id}
-        data_collection_bin = {"_id": 0, "*sample_name": 1, "lat": 1, "long": 1, "protected_coords": 1, "exclude": 1, "township": 1, "range": 1, "section": 1}
-        cursor = collection.find(query, data_collection_bin)
+            query = {"ccgp-project-id": project_id}
+            cursor = collection.find(query, COORD_FIELDS)
+            coord_documents = list(cursor)
 
-        coord_data_list = list(cursor)
+        coord_data_list = coord_documents
         #print(coord_data_list)
 
         fields_to_select = [
@@ -638,9 +618,33 @@ def google_sheets(df_data, sample_names_to_compare, sheet_type, project_id):
 
     return all_proj_data_bin, coord_info, lat_long_dict
 
-def Check_coord_location(lat_long_dict, df_data):
+def resolve_offline(lat_long_dict):
+    """
+    Resolves every sample's coordinates to (country, state) in one vectorized pass over the boundary polygons.
+    Returns {} if no boundary file is available.
+    """
+    resolver = BoundaryResolver.load()
+    if resolver is None:
+        return {}
+    coords = {}
+    for key, (lat, long) in lat_long_dict.items():
+        try:
+            coords[key] = (float(lat), float(long))
+        except (TypeError, ValueError):
+            continue
+    found = resolver.resolve([c[0] for c in coords.values()], [c[1] for c in coords.values()])
+    return dict(zip(coords, found))
+
+
+def Check_coord_location(lat_long_dict, df_data, geolocator=None, use_network=True):
+    """
+    Finds "Country:State" for each sample's coordinates. Coordinates are first resolved offline against the
+    boundary polygons (utils/boundaries.py); only the ones that can't be are sent to the geocoder, unless use_network is False.
+    """
     
-    geolocator = Nominatim(user_agent="CCGP Data Wrangling Script", timeout=10)
+    if geolocator is None and use_network:  # Cached on disk, so reruns and co-located samples skip Nominatim.
+        geolocator = CachedReverseGeocoder(Nominatim(user_agent="CCGP Data Wrangling Script", timeout=10))
+    offline = resolve_offline(lat_long_dict)
     non_state_count = 0
     total_sample_count = 0
     grab_loc_data = {}
@@ -684,7 +688,12 @@ def Check_coord_location(lat_long_dict, df_data):
             print(f'Invalid coordinates for {key}')
             continue
 
-        location = geolocator.reverse((lat, long), exactly_one=True)
+        if offline.get(key):
+            location = CachedLocation({"address": dict(zip(("country", "state"), offline[key]))})
+        elif geolocator is not None:
+            location = geolocator.reverse((lat, long), exactly_one=True)
+        else:
+            location = None
 
         if location:
             address = location.raw.get('address', {})
@@ -732,14 +741,128 @@ def Check_coord_location(lat_long_dict, df_data):
     return grab_loc_data
 
 
+def read_batch(entries):
+    """
+    Returns (project_name, data_type, sheet_type) jobs. Each entry is either "project_name:data_type:sheet_type" or
+    a manifest file with one whitespace separated "project_name data_type sheet_type" per line (# starts a comment).
+    """
+    jobs = []
+    for entry in entries:
+        if os.path.isfile(entry):
+            with open(entry) as f:
+                lines = [line.split("#", 1)[0].split() for line in f]
+            jobs.extend(tuple(fields) for fields in lines if fields)
+        else:
+            jobs.append(tuple(entry.split(":")))
+
+    for job in jobs:
+        if len(job) != 3 or job[1] not in ("plant", "vertebrate", "invertebrate") or job[2] not in ("sra", "biosample"):
+            raise ValueError(f"Invalid batch entry {':'.join(job)}. Expected project_name:data_type:sheet_type.")
+    return list(dict.fromkeys(jobs))
+
+
+def fetch_projects_metadata(collection, project_ids, fields):
+    """
+    Fetches the sample_metadata documents of every project in one $in query and returns them keyed by ccgp-project-id.
+    """
+    projection = {"_id": 0, "ccgp-project-id": 1}
+    projection.update({field: 1 for field in fields if field != "_id"})
+    documents = {project_id: [] for project_id in project_ids}
+    for document in collection.find({"ccgp-project-id": {"$in": list(project_ids)}}, projection):
+        documents[document["ccgp-project-id"]].append(document)
+    return documents
+
+
+def project_documents(documents, data_collection_bin):
+    """Applies a projection to already fetched documents, the same way MongoDB would have."""
+    return [{key: value for key, value in document.items() if key in data_collection_bin} for document in documents]
+
+
+def run_batch(jobs, max_workers=None):
+    """
+    Generates the sheets of many projects in one run: one metadata query and one reads lookup for all projects,
+    one Mongo client and geocode cache, and TSVs generated/written in a process pool.
+    Coordinates are geocoded in this process so the Nominatim rate limit and cache are shared.
+    Returns the jobs that failed.
+    """
+    collection, reads_collection = Connect_MongoDB()
+    all_project_fields = list(Identify_Fields(collection))
+
+    fields = set(COORD_FIELDS)
+    for project_name, data_type, sheet_type in jobs:
+        fields.update(metadata_fields(data_type, sheet_type))
+    documents = fetch_projects_metadata(collection, {job[0] for job in jobs}, fields)
+
+    sra_projects = {project_name for project_name, _, sheet_type in jobs if sheet_type == "sra"}
+    project_files = {
+        project_name: [file for document in documents[project_name] if isinstance(document.get("files"), list) for file in document["files"]]
+        for project_name in sra_projects
+    }
+    reads_by_name = fetch_reads_by_name(reads_collection, [file for files in project_files.values() for file in files])
+
+    geolocator = None
+    if any(sheet_type == "biosample" for _, _, sheet_type in jobs):
+        geolocator = CachedReverseGeocoder(Nominatim(user_agent="CCGP Data Wrangling Script", timeout=10))
+
+    failed = []
+    futures = {}
+    # spawn, so the workers don't inherit the parent's MongoClient.
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for job in jobs:
+            project_name, data_type, sheet_type = job
+            try:
+                _, data_collection_bin, project_id = Write_Metadata(collection, all_project_fields, project_name, data_type, sheet_type, num_documents=len(documents[project_name]))
+                get_project_metadata = project_documents(documents[project_name], data_collection_bin)
+
+                if sheet_type == "sra":
+                    project_reads = {file: reads_by_name[file] for file in project_files[project_name] if file in reads_by_name}
+                    future = pool.submit(generate_TSV, get_project_metadata, data_collection_bin, all_project_fields, project_name, sheet_type, None, None, project_reads)
+                else:
+                    df_data, sample_names_to_compare = generate_TSV(get_project_metadata, data_collection_bin, all_project_fields, project_name, sheet_type, None, None)
+                    all_proj_data_bin, coord_info, lat_long_dict = google_sheets(df_data, sample_names_to_compare, sheet_type, project_id, documents[project_name])
+                    grab_loc_data = Check_coord_location(lat_long_dict, df_data, geolocator)
+                    # df_data and all_proj_data_bin are the same frame; they are pickled in one call, so they still are in the worker.
+                    future = pool.submit(create_biosample_TSV, get_project_metadata, data_collection_bin, all_project_fields, project_name, sheet_type, df_data, all_proj_data_bin, coord_info, grab_loc_data, None)
+                futures[future] = job
+            except Exception as e:
+                print(Fore.RED + f"An error has occured for {project_name} ({sheet_type}): {e}" + Style.RESET_ALL)
+                traceback.print_exc()
+                failed.append(job)
+
+        for future in as_completed(futures):
+            project_name, data_type, sheet_type = futures[future]
+            try:
+                future.result()
+                print(Fore.LIGHTGREEN_EX + f"Success! The requested SHEET: {sheet_type}, for PROJECT-ID: {project_name} was generated." + Style.RESET_ALL)
+            except Exception as e:
+                print(Fore.RED + f"An error has occured for {project_name} ({sheet_type}): {e}" + Style.RESET_ALL)
+                failed.append(futures[future])
+
+    print("")
+    print(f"Batch finished: {len(jobs) - len(failed)} of {len(jobs)} sheets generated.")
+    for project_name, data_type, sheet_type in failed:
+        print(Fore.RED + f"    Failed: {project_name} {data_type} {sheet_type}" + Style.RESET_ALL)
+    return failed
+
+
 def main():
     try:
         parser = argparse.ArgumentParser(description="Extract metadata for a specific project (ccgp-project-id) and data type (plant, vertebrate, invertebrate)")  # Add file type later... aka tsv or sra.
-        parser.add_argument("project_name", type=str, help="Specify the project name (associated with field 'ccgp-project-id')")  # Initializes 'project_name' Argument.
-        parser.add_argument("data_type", choices=["plant", "vertebrate", "invertebrate"], help="Specify the taxon type (plant, vertebrate, invertebrate)")  # Initializes 'data_type' Argument.
-        parser.add_argument("sheet_type", choices=["sra", "biosample"], help="Specify the output tsv file needed (sra or biosample)")  # Initializes 'sheet_type' Argument.
+        parser.add_argument("project_name", type=str, nargs="?", help="Specify the project name (associated with field 'ccgp-project-id')")  # Initializes 'project_name' Argument.
+        parser.add_argument("data_type", nargs="?", choices=["plant", "vertebrate", "invertebrate"], help="Specify the taxon type (plant, vertebrate, invertebrate)")  # Initializes 'data_type' Argument.
+        parser.add_argument("sheet_type", nargs="?", choices=["sra", "biosample"], help="Specify the output tsv file needed (sra or biosample)")  # Initializes 'sheet_type' Argument.
+        parser.add_argument("--batch", nargs="+", metavar="ENTRY", help="Generate many sheets in one run. Each ENTRY is project_name:data_type:sheet_type or a manifest file of 'project_name data_type sheet_type' lines.")
+        parser.add_argument("--workers", type=int, default=None, help="Number of processes writing sheets in batch mode (default: # of CPUs)")
         args = parser.parse_args()
 
+        if args.batch:
+            failed = run_batch(read_batch(args.batch), max_workers=args.workers)
+            if failed:
+                raise SystemExit(1)
+            return
+        if not (args.project_name and args.data_type and args.sheet_type):
+            parser.error("project_name, data_type and sheet_type are required unless --batch is given")
+
         collection, reads_collection = Connect_MongoDB()
 
         all_project_fields = Identify_Fields(collection)
@@ -0,0 +1,84 @@
+import boto3
+import pytest
+
+import utils.inventory
+
+moto = pytest.importorskip("moto")
+
+from utils.inventory import BUCKET, S3Inventory, discover_prefixes, list_objects_parallel
+
+KEYS = [
+    *(f"sample{i:04d}_R{r}_001.fastq.gz" for i in range(520) for r in (1, 2)),  # More than a page.
+    *(f"lane{lane}/s{i}_R1.fq.gz" for lane in range(3) for i in range(40)),
+    "0_first.txt",
+    "Zeta/readme.txt",
+    "~last",
+]
+
+
+@pytest.fixture(scope="module")
+def client():
+    with pytest.MonkeyPatch.context() as monkeypatch, moto.mock_aws():
+        for name in ("AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY", "AWS_SESSION_TOKEN"):
+            monkeypatch.setenv(name, "testing")
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        for key in KEYS:
+            client.put_object(Bucket=BUCKET, Key=key, Body=key.encode())
+        yield client
+
+
+def list_single(client) -> list:
+    paginator = client.get_paginator("list_objects_v2")
+    return [
+        (obj["Key"], obj["Size"], obj["ETag"])
+        for page in paginator.paginate(Bucket=BUCKET)
+        for obj in page.get("Contents", [])
+    ]
+
+
+def test_discover_prefixes(client):
+    assert discover_prefixes(client) == ["Zeta/", "lane0/", "lane1/", "lane2/"]
+
+
+@pytest.mark.parametrize("boundaries", [None, ["lane1/"], []])
+def test_parallel_listing_matches_single_listing(client, boundaries, monkeypatch):
+    monkeypatch.setattr(utils.inventory, "SHARD_BOUNDARIES", "5ls")  # Fewer ranges than the real ones, for speed.
+    objects = list_objects_parallel(client, max_workers=4, boundaries=boundaries)
+    found = sorted((obj.key, obj.size, obj.etag) for obj in objects)
+    assert found == list_single(client)
+    assert len(found) == len(KEYS)
+
+
+@pytest.fixture
+def inventory(client, tmp_path):
+    bucket = tmp_path.name.replace("_", "-").lower()[:60]
+    client.create_bucket(Bucket=bucket)
+    for key in ("m_R1.fq.gz", "n_R1.fq.gz", "x_R1.fq.gz", "lane5/a_R1.fq.gz", "lane5/b_R1.fq.gz"):
+        client.put_object(Bucket=bucket, Key=key, Body=b"1")
+    inventory = S3Inventory(tmp_path / "manifest.sqlite3", bucket=bucket, client=client, full_sync_hours=1000)
+    inventory.refresh(full=True, max_workers=2)
+    return inventory
+
+
+def keys(inventory) -> list[str]:
+    return [obj.key for obj in inventory.objects()]
+
+
+def test_incremental_refresh_finds_root_keys_and_prefixes_before_the_cursors(client, inventory):
+    client.put_object(Bucket=inventory.bucket, Key="a_R1.fq.gz", Body=b"1")  # Sorts before every root key.
+    client.put_object(Bucket=inventory.bucket, Key="b_lane/a_R1.fq.gz", Body=b"1")  # New prefix before the cursor.
+    client.put_object(Bucket=inventory.bucket, Key="n_R1.fq.gz", Body=b"changed")
+    client.delete_object(Bucket=inventory.bucket, Key="x_R1.fq.gz")
+
+    assert inventory.refresh() == 3  # The two new keys and the changed one; unchanged root keys aren't rewritten.
+    assert keys(inventory) == [
+        "a_R1.fq.gz",
+        "b_lane/a_R1.fq.gz",
+        "lane5/a_R1.fq.gz",
+        "lane5/b_R1.fq.gz",
+        "m_R1.fq.gz",
+        "n_R1.fq.gz",
+    ]
+    etags = {obj.key: obj.etag for obj in inventory.objects()}
+    assert etags["n_R1.fq.gz"] == client.head_object(Bucket=inventory.bucket, Key="n_R1.fq.gz")["ETag"]
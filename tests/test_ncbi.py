@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from utils.ncbi import explode_read_pairs, fill_geo_loc_name, fill_sample_title, pair_reads
+
+
+def test_fill_geo_loc_name():
+    df = pd.DataFrame(
+        {
+            "*geo_loc_name": [np.nan, np.nan, np.nan, np.nan, "USA: California", np.nan, "USA: California"],
+            "Locality Description": [np.nan, np.nan, np.nan, np.nan, np.nan, "Mono Lake", "Mono Lake"],
+            "State": [np.nan, "California", "", "California", "Nevada", "Nevada", "Nevada"],
+            "County": [np.nan, np.nan, "Inyo", "Inyo", "Washoe", "Washoe", "Washoe"],
+        }
+    )
+    assert fill_geo_loc_name(df)["*geo_loc_name"].tolist() == [
+        "missing",
+        "USA: California",
+        "missing",
+        "USA: California: Inyo",
+        "USA: California",
+        "Mono Lake",
+        "USA: California:Mono Lake",
+    ]
+
+
+def test_fill_sample_title():
+    df = pd.DataFrame({"sample_title": ["title", np.nan, ""], "minicore_seq_id": ["a", "b", "c"]})
+    assert fill_sample_title(df)["sample_title"].tolist() == ["title", "b", "c"]
+
+
+def test_explode_read_pairs():
+    df = pd.DataFrame(
+        {
+            "*sample_name": ["s1", "s2", "s3"],
+            "files": [
+                ["s1_L002_R2_001.fq.gz", "s1_L001_R1_001.fq.gz", "s1_L002_R1_001.fq.gz", "s1_L001_R2_001.fq.gz"],
+                np.nan,
+                ["s3_R1.fq.gz"],
+            ],
+        }
+    )
+    out = explode_read_pairs(df)
+    assert out["*sample_name"].tolist() == ["s1", "s1"]
+    assert out["filename"].tolist() == ["s1_L001_R1_001.fq.gz", "s1_L002_R1_001.fq.gz"]
+    assert out["filename2"].tolist() == ["s1_L001_R2_001.fq.gz", "s1_L002_R2_001.fq.gz"]
+    assert out["library_ID"].tolist() == ["s1_L001", "s1_L002"]
+
+
+def test_pair_reads_on_the_last_read_token(caplog):
+    files = ["CA_R1_S1_R2_001.fastq.gz", "CA_R1_S1_R1_001.fastq.gz", "CA_R2_S2_R1_001.fastq.gz"]
+    assert pair_reads(files) == [("CA_R1_S1_R1_001.fastq.gz", "CA_R1_S1_R2_001.fastq.gz")]
+    assert "CA_R2_S2_R1_001.fastq.gz" in caplog.text
+
+
+@pytest.mark.parametrize(
+    "df",
+    [
+        pd.DataFrame({"*sample_name": ["s1", "s2"], "files": [np.nan, np.nan]}),
+        pd.DataFrame({"*sample_name": ["s1"]}),
+        pd.DataFrame(columns=["*sample_name", "files"]),
+        pd.DataFrame(),
+    ],
+    ids=["all-nan files", "no files column", "empty", "no columns"],
+)
+def test_explode_read_pairs_without_reads(df):
+    out = explode_read_pairs(df)
+    assert out.empty
+    assert {"filename", "filename2", "library_ID"} <= set(out.columns)
+
+
+@pytest.mark.parametrize("fill", [fill_geo_loc_name, fill_sample_title])
+def test_fill_empty(fill):
+    assert fill(pd.DataFrame()).empty
+    assert fill(pd.DataFrame(columns=["*geo_loc_name", "sample_title"])).empty
@@ -2,7 +2,7 @@ import pygsheets
 import numpy as np
 import pandas as pd
 import parse
-from db import get_mongo_client
+from db import find_as_df, get_mongo_client
 from os import environ
 from dotenv import load_dotenv
 
@@ -11,16 +11,19 @@ def update_wgs_gsheet(db_client) -> None:
     load_dotenv()
     db = db_client["ccgp_dev"]
     collection = db["sample_metadata"]
-    df = pd.io.json.json_normalize(collection.find({}))
+    df = find_as_df(collection)
+    if "_id" in df:
+        df["_id"] = df["_id"].astype(str)
 
     gc = pygsheets.authorize(service_file=environ.get("GOOGLE_APPLICATION_CREDENTIALS"))
     sh = gc.open("WGS_METADATA_DB")
     wks = sh.worksheet_by_title("raw")
     wks.set_dataframe(df, (1, 1), fit=True)
+    del df
 
     ### summarize
     wks = sh.worksheet_by_title("summary")
-    summ = parse.get_summary_df(df)
+    summ = parse.get_summary_df(collection)
     metadata_summary = db["summary"]
     metadata_summary.insert_many(summ.to_dict("records"))
     wks.set_dataframe(summ, (1, 1))
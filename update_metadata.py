@@ -1,115 +1,268 @@
-from utils.db import get_mongo_client
+from utils.db import bulk_write_chunked, get_mongo_client, to_records
 import pymongo
-import utils.parse
+from utils import parse
 from pymongo.errors import BulkWriteError
 from pprint import pprint
 from datetime import datetime
 from pathlib import Path
+from tempfile import TemporaryDirectory
 import pandas as pd
 import os
 import argparse
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
 from utils.gdrive import CCGPDrive
+from utils.sheet_cache import SheetCache
 import sys
-from collections import defaultdict
+from collections import Counter, defaultdict, deque
+import logging
 import traceback
 
+CHANGES_KEY = "update_metadata"
 
-def update_metadata(db_client: pymongo.MongoClient, force=False, file: str = None):
-    """Parses metadata sheets from minicore and non minicore sources and updates database."""
+logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
+
+
+def update_metadata(
+    db_client: pymongo.MongoClient,
+    force=False,
+    file: str = None,
+    workers: int = None,
+    batch_size: int = 1000,
+    use_cache: bool = True,
+):
+    """
+    Parses metadata sheets from minicore and non minicore sources and updates database.
+
+    Sheets are downloaded on a thread pool and parsed on a pool of `workers` processes while earlier ones are
+    turned into ops. A sheet that fails to download, parse or be written gets its error recorded in
+    parsed_metadata_files without stopping the others. Ops are flushed to Mongo every `batch_size` samples.
+    Parsed sheets are kept in a SheetCache, so a version of a sheet that was parsed before is neither downloaded
+    nor parsed again, also when force is set, unless use_cache is False. The cache key includes parse.PARSER_VERSION
+    and the mtime of the project-id csv, and the project-id and reference accession of cached sheets are looked up
+    again.
+    """
     db = db_client["ccgp_dev"]
     collection = db["sample_metadata"]
     parsed_metadatas = db["parsed_metadata_files"]
     ccgp_workflow_progress = db["workflow_progress"]
 
+    drive = CCGPDrive()
+    folders = {"Non-Minicore Submissions": "non_minicore", "Minicore Submissions": "minicore"}
+
+    page_token = None
     if force or file is not None:
-        already_read = []
+        listing = {folder: drive.list_files_from_folder(folder) for folder in folders}
+        already_read = set()
     else:
-        already_read = [doc.get("file_name") for doc in parsed_metadatas.find({})]
-
-    drive = CCGPDrive()
+        # Only files added or modified since the last run; the first run lists both folders.
+        listing, page_token = drive.list_changed_files(*folders, key=CHANGES_KEY)
+        names = [item["name"] for items in listing.values() for item in items]
+        # Sheets whose samples could not be written count as unread, so they are retried.
+        already_read = {
+            doc.get("file_name")
+            for doc in parsed_metadatas.find(
+                {"file_name": {"$in": names}, "error": {"$not": {"$regex": "^Could not write"}}}, {"file_name": 1}
+            )
+        }
 
-    non_minicore_files = [
-        item
-        for item in drive.list_files_from_folder("Non-Minicore Submissions")
-        if item["name"] not in already_read
-    ]
-    minicore_files = [
-        item
-        for item in drive.list_files_from_folder("Minicore Submissions")
+    files = [
+        (item, project_type)
+        for folder, project_type in folders.items()
+        for item in listing[folder]
         if item["name"] not in already_read
     ]
-
-    non_minicore_files = [(f, "non_minicore") for f in non_minicore_files]
-    minicore_files = [(f, "minicore") for f in minicore_files]
-    files = non_minicore_files + minicore_files
     if not files:
         print("Nothing to be done.")
+        if page_token is not None:
+            drive.save_page_token(CHANGES_KEY, page_token)
         return
     if file is not None:
         files = [item for item in files if file in item["name"]]
+    project_ids = Counter()
     metadata_ops = []
     workflow_prog_ops = []
     parsed_ops = []
-    project_ids = defaultdict(int)
-    try:
-        for file, project_type in files:
-            file_name = file["name"]
-            print(file)
-            drive.download_files(file)
-
-            print("Processing file: " + "'" + file_name + "'")
-            df = parse.finalize_df(parse.read_sheet(Path(file_name), project_type))
-            print(f"Got a DataFrame of this shape: {df.shape}")
-            # Replace NaNs with empty string b/c JSON for web dashboard cannot encode NaN
-            # df = df.fillna("")
-            for _, row in df.iterrows():
-                record = row.to_dict()
-                project_ids[record["ccgp-project-id"]] += 1
-                print(
-                    f"Procesed sample {record['*sample_name']} in project {record['ccgp-project-id']}"
-                )
-                metadata_ops.append(
+
+    def flush() -> bool:
+        """
+        Writes the pending (file_name, op) pairs; sample metadata first, so a sheet is only marked as parsed once
+        its samples are in. A sheet whose samples could not all be written gets the error recorded instead of
+        being marked as parsed. Returns True if every write succeeded.
+        """
+        logging.info(f"{len(metadata_ops)=}, {len(parsed_ops)=}, {len(workflow_prog_ops)=} ")
+        # Ordered, so later sheets win for repeated samples.
+        _, failed = bulk_write_chunked(collection, [op for _, op in metadata_ops], batch_size, ordered=True)
+        write_errors = defaultdict(list)
+        for i, message in sorted(failed.items()):
+            write_errors[metadata_ops[i][0]].append(message)
+        for file_name, messages in write_errors.items():
+            print(f"Could not write {len(messages)} samples of file: {file_name}: {messages[0]}")
+        parsed = [op for file_name, op in parsed_ops if file_name not in write_errors]
+        parsed.extend(
+            pymongo.operations.UpdateOne(
+                filter={"file_name": file_name},
+                update={"$set": {"error": f"Could not write {len(messages)} samples: {messages[0]}"}},
+                upsert=True,
+            )
+            for file_name, messages in write_errors.items()
+        )
+        workflow = [op for file_name, op in workflow_prog_ops if file_name not in write_errors]
+        _, parsed_failed = bulk_write_chunked(parsed_metadatas, parsed, batch_size)
+        _, workflow_failed = bulk_write_chunked(ccgp_workflow_progress, workflow, batch_size)
+        metadata_ops.clear()
+        parsed_ops.clear()
+        workflow_prog_ops.clear()
+        return not (write_errors or parsed_failed or workflow_failed)
+
+    written = True
+    project_types = {item["id"]: project_type for item, project_type in files}
+    cache = SheetCache()
+    version = f"{parse.PARSER_VERSION}:{parse.PROJECT_IDS.stat().st_mtime_ns}"
+    cache_keys = {item["id"]: cache.key(item, project_type, version) for item, project_type in files}
+    parsing = {}  # Drive file id -> (records, error) from the cache, download error or parse job.
+    if use_cache:
+        for item, _ in files:
+            df = cache.get(cache_keys[item["id"]])
+            if df is not None:
+                parsing[item["id"]] = (to_records(parse.apply_lookups(df)), None)
+        logging.info(f"{len(parsing)} of {len(files)} sheets are cached")
+    to_download = [item for item, _ in files if item["id"] not in parsing]
+    paths = {}  # Drive file id -> downloaded sheet, removed once it has been parsed.
+    pending = deque(files)
+
+    def take_results(wait: bool) -> None:
+        """
+        Turns the results at the head of pending into ops, in listing order as when files were done one by one.
+        Unless wait is set, stops at the first sheet that is still downloading or being parsed.
+        """
+        nonlocal written
+        while pending:
+            file, _ = pending[0]
+            job = parsing.get(file["id"])
+            if job is None or (not wait and isinstance(job, Future) and not job.done()):
+                return
+            pending.popleft()
+            take_result(file, job)
+            if len(metadata_ops) >= batch_size:
+                written = flush() and written
+
+    def take_result(file: dict, job) -> None:
+        """Adds the ops for one sheet, given its cached records, download error or parse job."""
+        file_name = file["name"]
+        if isinstance(job, Exception):
+            records, error_message = None, "".join(traceback.format_exception(job))
+        elif isinstance(job, tuple):
+            records, error_message = job
+        else:
+            records, error_message = job.result()
+        if error_message is not None:
+            print(f"Caught exception processing file: {file_name}:")
+            print(error_message)
+            parsed_ops.append(
+                (
+                    file_name,
                     pymongo.operations.UpdateOne(
-                        filter={"*sample_name": record["*sample_name"]},
-                        update={"$set": record},
+                        filter={"file_name": file_name},
+                        update={"$set": {"error": error_message}},
                         upsert=True,
-                    )
+                    ),
                 )
-            counts = (file_name, project_ids[record["ccgp-project-id"]])
-            workflow_prog_ops.append(
+            )
+            return
+
+        print("Processing file: " + "'" + file_name + "'")
+        project_ids.update(record["ccgp-project-id"] for record in records)
+        metadata_ops.extend(
+            (
+                file_name,
                 pymongo.operations.UpdateOne(
-                    filter={"project_id": record["ccgp-project-id"]},
-                    update={"$addToSet": {"Metadata recieved": counts}},
+                    filter={"*sample_name": record["*sample_name"]},
+                    update={"$set": record},
                     upsert=True,
+                ),
+            )
+            for record in records
+        )
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for record in records:
+                logging.debug(
+                    f"Procesed sample {record['*sample_name']} in project {record['ccgp-project-id']}"
+                )
+        if records:
+            project_id = records[-1]["ccgp-project-id"]
+            counts = (file_name, project_ids[project_id])
+            workflow_prog_ops.append(
+                (
+                    file_name,
+                    pymongo.operations.UpdateOne(
+                        filter={"project_id": project_id},
+                        update={"$addToSet": {"Metadata recieved": counts}},
+                        upsert=True,
+                    ),
                 )
             )
 
-            parsed_ops.append(
+        parsed_ops.append(
+            (
+                file_name,
                 pymongo.operations.UpdateOne(
                     filter={"file_name": file_name},
-                    update={"$set": {"file_name": file_name}},
+                    update={"$set": {"file_name": file_name}, "$unset": {"error": ""}},
                     upsert=True,
-                )
+                ),
             )
-            print("Done processing file: " + "'" + file_name + "'")
-            Path(file_name).unlink()
-
-    except Exception as e:  # Try to catch erros when processing a file.
-        error_message = traceback.format_exc()
-        print(f"Caught exception processing file: {file_name}:")
-        print(error_message)
-        parsed_metadatas.update_one(
-            filter={"file_name": file_name},
-            update={"$set": {"error": error_message}},
-            upsert=True,
         )
-    print(f"{len(metadata_ops)=}, {len(parsed_ops)=}, {len(workflow_prog_ops)=} ")
+        print("Done processing file: " + "'" + file_name + "'")
+        if not isinstance(job, tuple):
+            paths.pop(file["id"]).unlink()
+
+    # spawn, so the parsing processes don't inherit the parent's MongoClient.
+    with TemporaryDirectory() as download_dir, ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as pool:
+        for item, result in drive.iter_downloads(to_download, dest_dir=download_dir, dest_by_id=True):
+            if isinstance(result, Exception):
+                parsing[item["id"]] = result
+            else:
+                paths[item["id"]] = result
+                parsing[item["id"]] = pool.submit(
+                    parse_sheet,
+                    str(result),
+                    project_types[item["id"]],
+                    item["name"],
+                    cache_keys[item["id"]],
+                    str(cache.path),
+                )
+            take_results(wait=False)
+        take_results(wait=True)
+
+    written = flush() and written
+    cache.evict()
+    if page_token is not None:
+        if written:  # Every changed file is now either parsed or has its error recorded.
+            drive.save_page_token(CHANGES_KEY, page_token)
+        else:
+            print("Some writes failed; the changes will be listed again on the next run.")
+
+
+def parse_sheet(path: str, project_type: str, file_name: str, cache_key: str = None, cache_path: str = None):
+    """
+    Process pool worker: reads and finalizes one sheet downloaded to path as file_name, and stores it in the
+    SheetCache under cache_key. Returns (records, None), or (None, traceback) if the sheet could not be parsed.
+    """
     try:
-        collection.bulk_write(metadata_ops)
-        parsed_metadatas.bulk_write(parsed_ops)
-        ccgp_workflow_progress.bulk_write(workflow_prog_ops)
-    except BulkWriteError as bwe:
-        pprint(bwe.details)
+        df = parse.read_sheet(Path(path), project_type)
+        df["metadata_file"] = file_name
+        df = parse.finalize_df(df)
+        print(f"Got a DataFrame of this shape: {df.shape} from '{file_name}'")
+        if cache_key is not None and not SheetCache(cache_path).put(cache_key, df):
+            print(f"Could not cache '{file_name}'; it will be parsed again next time.")
+        # Replace NaNs with empty string b/c JSON for web dashboard cannot encode NaN
+        # df = df.fillna("")
+        return to_records(df), None
+    except Exception:
+        return None, traceback.format_exc()
 
 
 def add_biosample_accessions(db_client: pymongo.MongoClient,) -> None:
@@ -136,20 +289,20 @@ def add_biosample_accessions(db_client: pymongo.MongoClient,) -> None:
         print(file_name)
         df = pd.read_csv(file_name, sep="\t", header=0)
 
-        for _, row in df.iterrows():
-            record = row.to_dict()
-            operations.append(
-                pymongo.operations.UpdateOne(
-                    filter={
-                        "*sample_name": record["sample_name"]
-                        .replace(" ", "_")
-                        .replace(".", "_")
-                    },
-                    update={"$set": {"biosample_accession": record["accession"]}},
-                    upsert=False,
-                )
+        sample_names = df["sample_name"].str.replace(" ", "_", regex=False).str.replace(".", "_", regex=False)
+        accessions = df["accession"].tolist()
+        operations.extend(
+            pymongo.operations.UpdateOne(
+                filter={"*sample_name": sample_name},
+                update={"$set": {"biosample_accession": accession}},
+                upsert=False,
             )
-            print(f"Added {record['accession']} to {record['sample_name']}")
+            for sample_name, accession in zip(sample_names.tolist(), accessions)
+        )
+        logging.info(f"Adding {len(df)} biosample accessions from '{file_name}'")
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for sample_name, accession in zip(df["sample_name"].tolist(), accessions):
+                logging.debug(f"Added {accession} to {sample_name}")
 
     try:
         collection.bulk_write(operations)
@@ -169,6 +322,12 @@ def add_biosample_accessions(db_client: pymongo.MongoClient,) -> None:
 def main():
     db = get_mongo_client()
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-v",
+        dest="verbose",
+        action="store_true",
+        help="Log every sample that is processed",
+    )
 
     subparser = parser.add_subparsers(
         dest="command", title="subcommands", description="valid subcommands"
@@ -179,17 +338,32 @@ def main():
         dest="force",
         required=False,
         action="store_true",
-        help="Force rerun all sheets",
+        help="Force rerun all sheets (cached ones are still read from the cache, see --no-cache)",
     )
     metadata.add_argument(
         dest="file", nargs="?", default=None, help="Run this specific file"
     )
+    metadata.add_argument(
+        "--no-cache",
+        dest="use_cache",
+        action="store_false",
+        help="Parse every sheet again instead of using cached results",
+    )
+    metadata.add_argument(
+        "-j",
+        dest="workers",
+        type=int,
+        default=None,
+        help="Number of processes parsing sheets (default: # of CPUs)",
+    )
     attributes = subparser.add_parser(
         "attributes", description="Update biosample accessions"
     )
     both = subparser.add_parser("both", description="Update both")
 
     args = parser.parse_args()
+    if args.verbose:
+        logging.getLogger().setLevel(logging.DEBUG)
 
     if args.command == "metadata":
         if args.force:
@@ -198,7 +372,7 @@ def main():
         else:
             force = False
 
-        update_metadata(db, force, args.file)
+        update_metadata(db, force, args.file, workers=args.workers, use_cache=args.use_cache)
     elif args.command == "attributes":
         add_biosample_accessions(db)
     elif args.command == "both":
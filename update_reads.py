@@ -1,8 +1,10 @@
-import boto3
 import pymongo
 from dotenv import load_dotenv
 from os import getenv
-from utils.db import get_mongo_client
+from utils.db import bulk_write_chunked, get_mongo_client
+from utils.indexes import ensure_indexes
+from utils.inventory import S3Inventory
+from utils.matching import ReadsAutomaton, seq_id_queries
 from pymongo.errors import BulkWriteError
 from pprint import pprint
 from collections import defaultdict
@@ -15,6 +17,7 @@ import logging
 import numpy as np
 import sys
 import math
+import argparse
 
 #DOESN'T OVERRIDE EXISTING FILES! 
 
@@ -22,48 +25,49 @@ logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
 
 # Change CCGP-project on line 182.
 def list_s3_bucket_objs():
-    """Returns s3 objectCollection"""
-    load_dotenv()
-    s3 = boto3.resource(
-        "s3",
-        aws_access_key_id=getenv("aws_access_key_id"),
-        aws_secret_access_key=getenv("aws_secret_access_key"),
-        endpoint_url=getenv("endpoint_url"),
-    )
-    bucket = s3.Bucket("ccgp")
-
-    return bucket.objects.all()
+    """Returns objects in the ccgp bucket from the local S3 inventory, refreshed incrementally."""
+    inventory = S3Inventory()
+    inventory.refresh()
+    return inventory.objects()
 
 
-def update_db_all(db_client: pymongo.MongoClient, files):
-    """Updates db with list of files."""
+def update_db_all(db_client: pymongo.MongoClient, files, diff: bool = True, batch_size: int = 1000):
+    """
+    Updates db with list of files. With diff, keys already in the reads collection are skipped instead of
+    being sent as no-op upserts. Writes go out unordered in batches of batch_size.
+    """
     db = db_client["ccgp_dev"]
     collection = db["reads"]
 
-    operations = []
-    for file in files:
-        operations.append(
-            pymongo.operations.UpdateOne(  # type: ignore
-                filter={"file_name": file.key},
-                update={
-                    "$setOnInsert": {
-                        "filesize": file.size,
-                        "mdate": file.last_modified,
-                    }
-                },  # Since upsert is true, we dont need to set file_name explicitly.
-                upsert=True,
-            )
+    if diff:
+        cursor = collection.find({}, {"_id": 0, "file_name": 1}, batch_size=10000)
+        if "file_name_1" in collection.index_information():
+            cursor = cursor.hint([("file_name", pymongo.ASCENDING)])  # Covered: answered from the index alone.
+        existing = {doc.get("file_name") for doc in cursor}
+        files = (file for file in files if file.key not in existing)
+
+    operations = (
+        pymongo.operations.UpdateOne(  # type: ignore
+            filter={"file_name": file.key},
+            update={
+                "$setOnInsert": {
+                    "filesize": file.size,
+                    "mdate": file.last_modified,
+                }
+            },  # Since upsert is true, we dont need to set file_name explicitly.
+            upsert=True,
         )
-    try:
-        collection.bulk_write(operations)
-
-    except BulkWriteError as bwe:
-        print(bwe.details)
+        for file in files
+    )
+    sent, failed = bulk_write_chunked(collection, operations, batch_size)
+    logging.info(f" Upserted {sent - len(failed)} files into reads collection")
+    if failed:
+        logging.error(f" {len(failed)} files could not be upserted")
 
 
-def search(sample: dict, files: list[dict]):
+def search(sample: dict, index: ReadsAutomaton):
     """
-    Searches query file name in list of files. We search for the name followed by any of: ["_", "-", "."].
+    Searches query file name in the reads index. We search for the name followed by any of: ["_", "-", "."].
     Returns a tuple of the matched sample, bool if pref_id was used for matching, and the found files.
     """
 
@@ -79,51 +83,27 @@ def search(sample: dict, files: list[dict]):
         found_files = []
 
         for minicore_id in minicore_ids:
-            found = [
-                file
-                for file in files
-                if f"{minicore_id}_" in file["file_name"]
-                or f"{minicore_id}-" in file["file_name"]
-                or f"{minicore_id}." in file["file_name"]
-            ]
+            found = index.find(minicore_id)
             found_files.extend(found)
             if found_files:
                 return found_files
             elif "_" in minicore_id:
                 
                 q = minicore_id.replace("_", "-")
-                found = [
-                    file
-                    for file in files
-                    if f"{q}_" in file["file_name"]
-                    or f"{q}-" in file["file_name"]
-                    or f"{q}." in file["file_name"]
-                ]
+                found = index.find(q)
                 found_files.extend(found)
                 if found_files:
                     return found_files
                 else:
                     q = minicore_id.replace("-", "")
                     
-                    found = [
-                        file
-                        for file in files
-                        if f"{q}_" in file["file_name"]
-                        or f"{q}-" in file["file_name"]
-                        or f"{q}." in file["file_name"]
-                    ]
+                    found = index.find(q)
                     found_files.extend(found)
                     if found_files:
                         return found_files
             elif "-" in minicore_id:
                 q = minicore_id.replace("-", "_")
-                found = [
-                    file
-                    for file in files
-                    if f"{q}" in file["file_name"]
-                    or f"{q}-" in file["file_name"]
-                    or f"{q}." in file["file_name"]
-                ]
+                found = index.find(q, suffixes=("",))  # Bare substring, as before.
                 found_files.extend(found)
                 if found_files:
                     return found_files
@@ -198,6 +178,11 @@ def link_files_to_metadata(db_client: pymongo.MongoClient):
     #sample_names = list(metadata.find({"*sample_name": "811"})) 
     
     reads = list(reads_db.find({}))
+    # One pass over every read key for all samples' minicore ids instead of a search per sample.
+    queries = set()
+    for sample in sample_names:
+        queries |= seq_id_queries(sample.get("minicore_seq_id"))
+    reads_index = ReadsAutomaton(reads, queries)
     print(f"Found {len(reads)} reads.")
     print(f"Found {len(sample_names)} samples.")
     metadata_ops = []
@@ -222,13 +207,17 @@ def link_files_to_metadata(db_client: pymongo.MongoClient):
             print(f"sample: {name} not sequenced, skipping")
             continue
         found_files = []
-        search_result = search(sample, reads)
+        search_result = search(sample, reads_index)
 
         if search_result:
             matched_sample, used_pref_id, found_files = search_result
 
             
             print("Found files:", found_files)
+            for file in found_files:
+                match_dict[file["file_name"]].append(
+                    {"sample": matched_sample, "pref_id_bool": used_pref_id}
+                )
 
         if found_files:
             #print(f"Found files for {name}: {found_files}")
@@ -373,9 +362,21 @@ def link_files_to_metadata(db_client: pymongo.MongoClient):
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--full-upsert",
+        action="store_true",
+        help="Upsert every object in the bucket instead of only keys missing from the reads collection",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=1000, help="Number of writes per bulk batch"
+    )
+    args = parser.parse_args()
+
     files = list_s3_bucket_objs()
     db_client = get_mongo_client()
-    update_db_all(db_client, files)
+    ensure_indexes(db_client["ccgp_dev"])
+    update_db_all(db_client, files, diff=not args.full_upsert, batch_size=args.batch_size)
     link_files_to_metadata(db_client)
 
 
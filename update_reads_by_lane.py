@@ -1,9 +1,11 @@
-import boto3
 import pymongo
 from dotenv import load_dotenv
 import os
 from os import getenv
-from utils.db import get_mongo_client
+from utils.db import bulk_write_chunked, get_mongo_client
+from utils.indexes import ensure_indexes
+from utils.inventory import S3Inventory
+from utils.matching import ReadsAutomaton, seq_id_queries
 from pymongo.errors import BulkWriteError
 from pprint import pprint
 from collections import defaultdict
@@ -26,49 +28,50 @@ logging.basicConfig(format="%(levelname)s:%(message)s", level=logging.INFO)
 
 
 def list_s3_bucket_objs():
-    """Returns s3 objectCollection"""
-    load_dotenv()
-    s3 = boto3.resource(
-        "s3",
-        aws_access_key_id=getenv("aws_access_key_id"),
-        aws_secret_access_key=getenv("aws_secret_access_key"),
-        endpoint_url=getenv("endpoint_url"),
-    )
-    bucket = s3.Bucket("ccgp")
-
-    return bucket.objects.all()
+    """Returns objects in the ccgp bucket from the local S3 inventory, refreshed incrementally."""
+    inventory = S3Inventory()
+    inventory.refresh()
+    return inventory.objects()
 
 
-def update_db_all(db_client: pymongo.MongoClient, files):
-    """Updates db with list of files."""
+def update_db_all(db_client: pymongo.MongoClient, files, diff: bool = True, batch_size: int = 1000):
+    """
+    Updates db with list of files. With diff, keys already in the reads collection are skipped instead of
+    being sent as no-op upserts. Writes go out unordered in batches of batch_size.
+    """
     db = db_client["ccgp_dev"]
     collection = db["reads"]
 
-    operations = []
-    for file in files:
-        operations.append(
-            pymongo.operations.UpdateOne(  # type: ignore
-                filter={"file_name": file.key},
-                update={
-                    "$setOnInsert": {
-                        "filesize": file.size,
-                        "mdate": file.last_modified,
-                        "instrument_model": "Illumina NovaSeq X",
-                    }
-                },  # Since upsert is true, we dont need to set file_name explicitly.
-                upsert=True,
-            )
+    if diff:
+        cursor = collection.find({}, {"_id": 0, "file_name": 1}, batch_size=10000)
+        if "file_name_1" in collection.index_information():
+            cursor = cursor.hint([("file_name", pymongo.ASCENDING)])  # Covered: answered from the index alone.
+        existing = {doc.get("file_name") for doc in cursor}
+        files = (file for file in files if file.key not in existing)
+
+    operations = (
+        pymongo.operations.UpdateOne(  # type: ignore
+            filter={"file_name": file.key},
+            update={
+                "$setOnInsert": {
+                    "filesize": file.size,
+                    "mdate": file.last_modified,
+                    "instrument_model": "Illumina NovaSeq X",
+                }
+            },  # Since upsert is true, we dont need to set file_name explicitly.
+            upsert=True,
         )
-    try:
-        collection.bulk_write(operations)
-
-    except BulkWriteError as bwe:
-        print(bwe.details)
+        for file in files
+    )
+    sent, failed = bulk_write_chunked(collection, operations, batch_size)
+    logging.info(f" Upserted {sent - len(failed)} files into reads collection")
+    if failed:
+        logging.error(f" {len(failed)} files could not be upserted")
 
 
-def search(sample: dict, files: list[dict]):
+def search(sample: dict, index: ReadsAutomaton):
     """
-    Searches query file name in list of files. We search for the name followed by any of: ["_", "-", "."].
+    Searches query file name in the reads index. We search for the name followed by any of: ["_", "-", "."].
     Returns a tuple of the matched sample, bool if pref_id was used for matching, and the found files.
     """
 
@@ -80,48 +83,24 @@ def search(sample: dict, files: list[dict]):
 
             return False
         
-        found = [
-            file
-            for file in files
-            if f"{q}_" in file["file_name"]
-            or f"{q}-" in file["file_name"]
-            or f"{q}." in file["file_name"]
-        ]
+        found = index.find(q)
         if found:
             return found
         elif "_" in q:
             
             q = q.replace("_", "-")
-            found = [
-                file
-                for file in files
-                if f"{q}_" in file["file_name"]
-                or f"{q}-" in file["file_name"]
-                or f"{q}." in file["file_name"]
-            ]
+            found = index.find(q)
             if found:
                 return found
             else:
                 q = q.replace("-", "")
                 
-                found = [
-                    file
-                    for file in files
-                    if f"{q}_" in file["file_name"]
-                    or f"{q}-" in file["file_name"]
-                    or f"{q}." in file["file_name"]
-                ]
+                found = index.find(q)
                 if found:
                     return found
         elif "-" in q:
             q = q.replace("-", "_")
-            found = [
-                file
-                for file in files
-                if f"{q}" in file["file_name"]
-                or f"{q}-" in file["file_name"]
-                or f"{q}." in file["file_name"]
-            ]
+            found = index.find(q, suffixes=("",))  # Bare substring, as before.
             if found:
                 return found
         return False
@@ -203,6 +182,11 @@ def link_files_to_metadata(db_client: pymongo.MongoClient, lane_name: str):
     #)
     
     reads = list(reads_db.find({}))
+    # One pass over every read key for all samples' minicore ids instead of a search per sample.
+    queries = set()
+    for sample in sample_names:
+        queries |= seq_id_queries(sample.get("minicore_seq_id"))
+    reads_index = ReadsAutomaton(reads, queries)
     log_file.write(f"Found {len(reads)} reads.")
     log_file.write(f"Found {len(sample_names)} samples.\n")
     log_file.write('\n')
@@ -232,7 +216,7 @@ def link_files_to_metadata(db_client: pymongo.MongoClient, lane_name: str):
             continue
 
         found_files = []
-        search_result = search(sample, reads)
+        search_result = search(sample, reads_index)
 
         if search_result:
             matched_sample, used_pref_id, found_files = search_result
@@ -240,6 +224,10 @@ def link_files_to_metadata(db_client: pymongo.MongoClient, lane_name: str):
             
             log_file.write(f"Found files: {found_files}\n")
             log_file.write('\n')
+            for file in found_files:
+                match_dict[file["file_name"]].append(
+                    {"sample": matched_sample, "pref_id_bool": used_pref_id}
+                )
 
         if found_files:
             #print(f"Found files for {name}: {found_files}")
@@ -348,12 +336,15 @@ def main():
 
     parser = argparse.ArgumentParser()
     parser.add_argument("--lane-name", type=str, help="Specify the QB3/CAT Lane name for updates")
+    parser.add_argument("--full-upsert", action="store_true", help="Upsert every object in the bucket instead of only new keys")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Number of writes per bulk batch")
     args = parser.parse_args()
     #lane_names = args.lane_name.split(',')
 
     files = list_s3_bucket_objs()
     db_client = get_mongo_client()
-    update_db_all(db_client, files)
+    ensure_indexes(db_client["ccgp_dev"])
+    update_db_all(db_client, files, diff=not args.full_upsert, batch_size=args.batch_size)
     # if args.lane_name and len(lane_names) == 1:
     if args.lane_name:
         link_files_to_metadata(db_client, args.lane_name)
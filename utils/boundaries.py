@@ -0,0 +1,167 @@
+"""
+Offline (country, state) lookup for coordinates using boundary polygons, so most samples never need Nominatim.
+
+Boundaries are read from a GeoJSON FeatureCollection of first-level admin areas (states/provinces), by default
+utils/data/admin1_boundaries.geojson or the path in the `geo_boundaries` env variable. The data is not kept in the
+repo; fetch Natural Earth's "Admin 1 - States, Provinces" (ne_10m_admin_1_states_provinces, ~40 MB) with
+
+    python3 boundaries.py fetch
+
+Each feature needs the state name in `name` and the country in `admin`. Only countries in COUNTRY_ALIASES, whose
+Nominatim spelling (country and state names) is known to match, are resolved; points anywhere else resolve to None
+and are left to the geocoder, so results read the same whichever way they were found.
+"""
+import argparse
+import json
+import os
+import urllib.request
+from os import getenv
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+
+DEFAULT_BOUNDARIES = Path(__file__).parent / "data" / "admin1_boundaries.geojson"
+NATURAL_EARTH_URL = (
+    "https://raw.githubusercontent.com/nvkelso/natural-earth-vector/master/geojson/"
+    "ne_10m_admin_1_states_provinces.geojson"
+)
+# Natural Earth `admin` -> Nominatim country name, for the countries whose admin-1 names match Nominatim's.
+COUNTRY_ALIASES = {"United States of America": "United States"}
+CELL_DEGREES = 1.0
+
+
+def fetch(path=None, url: str = NATURAL_EARTH_URL) -> Path:
+    """Downloads the boundary GeoJSON to path (default: where BoundaryResolver.load looks) and returns the path."""
+    load_dotenv()
+    path = Path(path or getenv("geo_boundaries") or DEFAULT_BOUNDARIES)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    part = path.with_name(path.name + ".part")
+    try:
+        urllib.request.urlretrieve(url, part)
+        os.replace(part, path)
+    finally:
+        part.unlink(missing_ok=True)
+    return path
+
+
+def _rings(geometry: dict) -> list[np.ndarray]:
+    """All rings (outer and holes) of a Polygon/MultiPolygon as (n, 2) lon/lat arrays."""
+    if geometry["type"] == "Polygon":
+        polygons = [geometry["coordinates"]]
+    elif geometry["type"] == "MultiPolygon":
+        polygons = geometry["coordinates"]
+    else:
+        return []
+    return [np.asarray(ring, dtype="float64")[:, :2] for polygon in polygons for ring in polygon]
+
+
+def _cell_id(cx: np.ndarray, cy: np.ndarray) -> np.ndarray:
+    """One int64 per grid cell, from cell column/row numbers (which fit easily in 32 bits each)."""
+    return (cx.astype("int64") << 32) + cy.astype("int64")
+
+
+class BoundaryResolver:
+    """
+    Point-in-polygon resolver over admin boundaries with a regular grid as spatial index.
+
+    The grid is kept as two arrays sorted by cell id, (cell, feature id) per cell a feature's bounding box overlaps,
+    so the candidate features of every point are found with a searchsorted instead of a lookup per point.
+    """
+
+    _loaded = {}
+
+    def __init__(self, features: list[dict], name_field: str = "name", country_field: str = "admin") -> None:
+        self.names = []
+        self.edges = []  # Per feature: (x1, y1, x2, y2) arrays of every ring edge.
+        cells, fids = [], []
+        for feature in features:
+            props = feature.get("properties", {})
+            country = props.get(country_field, "Unknown")
+            if country not in COUNTRY_ALIASES:
+                continue
+            rings = _rings(feature.get("geometry") or {"type": None})
+            if not rings:
+                continue
+            self.names.append((COUNTRY_ALIASES[country], props.get(name_field, "Unknown")))
+            starts = np.concatenate([ring[:-1] for ring in rings])
+            ends = np.concatenate([ring[1:] for ring in rings])
+            self.edges.append((starts[:, 0], starts[:, 1], ends[:, 0], ends[:, 1]))
+
+            points = np.concatenate(rings)
+            min_x, min_y = np.floor(points.min(axis=0) / CELL_DEGREES)
+            max_x, max_y = np.floor(points.max(axis=0) / CELL_DEGREES)
+            cx, cy = np.meshgrid(np.arange(min_x, max_x + 1), np.arange(min_y, max_y + 1))
+            cells.append(_cell_id(cx.ravel(), cy.ravel()))
+            fids.append(np.full(cx.size, len(self.names) - 1))
+        cells = np.concatenate(cells) if cells else np.empty(0, dtype="int64")
+        fids = np.concatenate(fids) if fids else np.empty(0, dtype="int64")
+        order = np.lexsort((fids, cells))
+        self.grid_cells, self.grid_fids = cells[order], fids[order]
+
+    @classmethod
+    def load(cls, path=None):
+        """Resolver for the boundary file at path (cached per process), or None if there is no such file."""
+        load_dotenv()
+        path = Path(path or getenv("geo_boundaries") or DEFAULT_BOUNDARIES)
+        if path not in cls._loaded:
+            if not path.exists():
+                return None
+            with open(path) as f:
+                cls._loaded[path] = cls(json.load(f)["features"])
+        return cls._loaded[path]
+
+    def _contains(self, fid: int, x: np.ndarray, y: np.ndarray, chunk: int = 2_000_000) -> np.ndarray:
+        """Even-odd crossing test of points (x, y) against every ring of feature fid."""
+        x1, y1, x2, y2 = self.edges[fid]
+        inside = np.zeros(len(x), dtype=bool)
+        step = max(1, chunk // len(x1))
+        for i in range(0, len(x), step):
+            px, py = x[i : i + step, None], y[i : i + step, None]
+            straddles = (y1 > py) != (y2 > py)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+            crossings = np.count_nonzero(straddles & (px < x_cross), axis=1)
+            inside[i : i + step] = crossings % 2 == 1
+        return inside
+
+    def resolve(self, lats, longs) -> list:
+        """Returns (country, state) for each coordinate, or None where no boundary contains it."""
+        lat = np.asarray(lats, dtype="float64")
+        lon = np.asarray(longs, dtype="float64")
+        result = np.full(len(lat), -1)
+        points = np.flatnonzero(~(np.isnan(lat) | np.isnan(lon)))
+        cells = _cell_id(np.floor(lon[points] / CELL_DEGREES), np.floor(lat[points] / CELL_DEGREES))
+
+        # Every (point, feature) pair whose grid cell matches, grouped by feature.
+        first = np.searchsorted(self.grid_cells, cells, side="left")
+        counts = np.searchsorted(self.grid_cells, cells, side="right") - first
+        starts = np.repeat(first, counts)
+        within = np.arange(len(starts)) - np.repeat(np.cumsum(counts) - counts, counts)
+        fids = self.grid_fids[starts + within]
+        candidates = np.repeat(points, counts)
+        order = np.argsort(fids, kind="stable")
+        fids, candidates = fids[order], candidates[order]
+        bounds = np.flatnonzero(np.diff(fids)) + 1
+
+        for fid, idx in zip(fids[np.r_[0, bounds]] if len(fids) else [], np.split(candidates, bounds)):
+            idx = idx[result[idx] == -1]  # First matching feature wins.
+            if len(idx):
+                inside = self._contains(fid, lon[idx], lat[idx])
+                result[idx[inside]] = fid
+        return [self.names[fid] if fid >= 0 else None for fid in result]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparser = parser.add_subparsers(dest="command", title="subcommands", description="valid subcommands")
+    fetch_parser = subparser.add_parser("fetch", description="Download the boundary GeoJSON")
+    fetch_parser.add_argument("--path", default=None, help="Where to save it (default: where load() looks)")
+    fetch_parser.add_argument("--url", default=NATURAL_EARTH_URL)
+    args = parser.parse_args()
+    if args.command == "fetch":
+        print(f"Saved boundaries to {fetch(args.path, args.url)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,12 @@
-import boto3
 import pymongo
-from dotenv import load_dotenv
-from os import getenv
 from db import get_mongo_client
+from inventory import get_s3_client, list_objects_parallel
 
 
 
 def list_s3_bucket_objs():
-    """Returns s3 objectCollection"""
-    load_dotenv()
-    s3 = boto3.resource(
-        "s3",
-        aws_access_key_id=getenv("aws_access_key_id"),
-        aws_secret_access_key=getenv("aws_secret_access_key"),
-        endpoint_url=getenv("endpoint_url"),
-    )
-    bucket = s3.Bucket("ccgp")
-
-    return bucket.objects.all()
+    """Yields every object in the ccgp bucket, listing key ranges in parallel."""
+    return list_objects_parallel(get_s3_client())
 
 
 
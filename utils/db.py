@@ -1,11 +1,134 @@
+import logging
 import pymongo
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
 from dotenv import load_dotenv
+from typing import NamedTuple
+import numpy as np
+import pandas as pd
 import os
 
+# Client settings read from the environment (.env) when set. Anything unset keeps pymongo's default.
+CLIENT_OPTION_ENV = {
+    "maxPoolSize": ("MONGO_MAX_POOL_SIZE", int),
+    "minPoolSize": ("MONGO_MIN_POOL_SIZE", int),
+    "serverSelectionTimeoutMS": ("MONGO_SERVER_SELECTION_TIMEOUT_MS", int),
+    "connectTimeoutMS": ("MONGO_CONNECT_TIMEOUT_MS", int),
+    "socketTimeoutMS": ("MONGO_SOCKET_TIMEOUT_MS", int),
+    "compressors": ("MONGO_COMPRESSORS", str),  # e.g. "zstd,zlib"
+    "readPreference": ("MONGO_READ_PREFERENCE", str),  # e.g. "secondaryPreferred"
+}
 
-def get_mongo_client() -> pymongo.MongoClient:
-    """Utility function to get MongoDB client."""
-    load_dotenv()
-    DB_CONNECT_STRING = os.getenv("DB_CONNECT_STRING")
-    client = pymongo.MongoClient(DB_CONNECT_STRING)
-    return client
+_clients = {}
+
+
+class Collections(NamedTuple):
+    """Handles to the ccgp_dev collections the scripts use."""
+
+    sample_metadata: Collection
+    reads: Collection
+    parsed_metadata_files: Collection
+    workflow_progress: Collection
+    summary: Collection
+
+
+def _client_options() -> dict:
+    options = {}
+    for option, (env, cast) in CLIENT_OPTION_ENV.items():
+        value = os.getenv(env)
+        if value:
+            options[option] = cast(value)
+    return options
+
+
+def get_mongo_client(**options) -> pymongo.MongoClient:
+    """
+    Utility function to get MongoDB client. The client (and its connection pool) is created once per
+    process and reused by every later call with the same options.
+    """
+    key = (os.getpid(), tuple(sorted(options.items())))  # MongoClient must not be shared across a fork.
+    if key not in _clients:
+        load_dotenv()
+        DB_CONNECT_STRING = os.getenv("DB_CONNECT_STRING")
+        _clients[key] = pymongo.MongoClient(DB_CONNECT_STRING, **{**_client_options(), **options})
+    return _clients[key]
+
+
+def get_collections(db_name: str = "ccgp_dev") -> Collections:
+    """Returns handles to the collections in db_name using the shared client."""
+    db = get_mongo_client()[db_name]
+    return Collections(*(db[name] for name in Collections._fields))
+
+
+def to_records(df) -> list[dict]:
+    """
+    Rows of a DataFrame as dicts ready for MongoDB, built in one pass with to_dict("records"). Values are left as
+    row.to_dict() gave them (None stays None and NaN stays NaN), except that NaT and pd.NA, which BSON can't
+    encode, become None.
+    """
+    df = df.astype(object)
+    missing = df.isna().to_numpy()
+    if missing.any():
+        values = df.to_numpy(copy=True)
+        rows, cols = np.nonzero(missing)
+        unencodable = np.fromiter(
+            (values[row, col] is pd.NaT or values[row, col] is pd.NA for row, col in zip(rows, cols)),
+            dtype=bool,
+            count=len(rows),
+        )
+        values[rows[unencodable], cols[unencodable]] = None
+        df = pd.DataFrame(values, index=df.index, columns=df.columns, dtype=object)
+    return df.to_dict("records")
+
+
+def find_as_df(collection, query: dict = None, projection: dict = None, chunk_size: int = 10000) -> pd.DataFrame:
+    """
+    Documents matching query as a json_normalize'd DataFrame. The cursor is streamed in batches of chunk_size and
+    each batch is flattened on its own, so the raw documents never all sit in memory at once.
+    """
+    cursor = collection.find(query or {}, projection, batch_size=chunk_size)
+    frames, chunk = [], []
+    for doc in cursor:
+        chunk.append(doc)
+        if len(chunk) >= chunk_size:
+            frames.append(pd.json_normalize(chunk))
+            chunk = []
+    if chunk or not frames:
+        frames.append(pd.json_normalize(chunk))
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+def bulk_write_chunked(collection, operations, batch_size: int = 1000, ordered: bool = False) -> tuple[int, dict]:
+    """
+    Sends operations to collection in bulk batches of batch_size.
+    Returns the number of operations sent and {index in operations: error message} for every one that wasn't
+    applied. In an ordered batch that includes the ones after the first error, which MongoDB never ran.
+    """
+    sent = 0
+    failed = {}
+    batch = []
+
+    def flush():
+        try:
+            collection.bulk_write(batch, ordered=ordered)
+        except BulkWriteError as bwe:
+            logging.debug(f"Bulk write errors: {bwe.details}")
+            errors = bwe.details.get("writeErrors", [])
+            for error in errors:
+                failed[sent + error["index"]] = error.get("errmsg", str(error))
+            if ordered and errors:
+                first = errors[0]["index"]
+                skipped = f"Not written; an earlier write in the batch failed: {errors[0].get('errmsg')}"
+                for i in range(first + 1, len(batch)):
+                    failed.setdefault(sent + i, skipped)
+
+    for op in operations:
+        batch.append(op)
+        if len(batch) >= batch_size:
+            flush()
+            sent += len(batch)
+            batch = []
+    if batch:
+        flush()
+        sent += len(batch)
+    return sent, failed
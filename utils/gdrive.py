@@ -1,22 +1,55 @@
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 import google.auth
-import io
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
+from os import getenv
 from pathlib import Path
 from dotenv import load_dotenv
 
 SCOPES = ["https://www.googleapis.com/auth/drive"]
+DOWNLOAD_WORKERS = 8
+DOWNLOAD_CHUNK_SIZE = 10 * 1024 * 1024
+DOWNLOAD_RETRIES = 5
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+DEFAULT_STATE = Path(__file__).parent / "drive_state.json"
+FILE_FIELDS = "id, name, modifiedTime, mimeType"
+FOLDER_MIME_TYPE = "application/vnd.google-apps.folder"
 
 
 class CCGPDrive:
     """Class for interacting with CCGP Data Wrangling drive."""
 
-    def __init__(self) -> None:
-        """Gets credentials and builds google drive service."""
+    def __init__(self, service=None, service_factory=None) -> None:
+        """
+        Gets credentials and builds google drive service.
+
+        A prebuilt service (e.g. a local stub in tests) can be passed instead. service_factory builds the extra
+        services that download threads use; without one, every thread shares `service`.
+        """
         load_dotenv()
-        self.creds, _ = google.auth.default(scopes=SCOPES)
-        self.service = build("drive", "v3", credentials=self.creds)
+        if service is None and service_factory is None:
+            self.creds, _ = google.auth.default(scopes=SCOPES)
+            service_factory = lambda: build("drive", "v3", credentials=self.creds)
+        self.service = service if service is not None else service_factory()
+        self._service_factory = service_factory or (lambda: self.service)
+        self._local = threading.local()
+        self.state_path = Path(getenv("drive_state") or DEFAULT_STATE)
+        self._state = None
+        self._checked_folder_ids = set()
+
+    def _thread_service(self):
+        """Drive service for the calling thread; the http client under a service is not thread safe."""
+        if threading.current_thread() is threading.main_thread():
+            return self.service
+        if not hasattr(self._local, "service"):
+            self._local.service = self._service_factory()
+        return self._local.service
 
     def _get_files_list_response(self, query: str) -> list[dict]:
         """ "Helper function that sends creates and send query to Drive API and returns response."""
@@ -28,7 +61,7 @@ class CCGPDrive:
                 .list(
                     q=query,
                     spaces="drive",
-                    fields="nextPageToken, files(id, name, modifiedTime, mimeType)",
+                    fields=f"nextPageToken, files({FILE_FIELDS})",
                     pageToken=page_token,
                 )
                 .execute()
@@ -44,12 +77,58 @@ class CCGPDrive:
                 break
         return result
 
+    @property
+    def state(self) -> dict:
+        """Folder ids and change page tokens persisted between runs in state_path."""
+        if self._state is None:
+            self._state = {"folder_ids": {}, "page_tokens": {}}
+            if self.state_path.exists():
+                with open(self.state_path) as f:
+                    self._state.update(json.load(f))
+        return self._state
+
+    def _save_state(self) -> None:
+        tmp = self.state_path.with_name(self.state_path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp, self.state_path)
+
+    def _is_folder(self, folder_id: str, folder: str) -> bool:
+        """Whether folder_id still names a folder called folder that isn't trashed."""
+        try:
+            found = (
+                self.service.files()
+                .get(fileId=folder_id, fields="id, name, mimeType, trashed", supportsAllDrives=True)
+                .execute()
+            )
+        except HttpError as e:
+            if e.resp.status == 404:
+                return False
+            raise
+        return found.get("name") == folder and found.get("mimeType") == FOLDER_MIME_TYPE and not found.get("trashed")
+
     def get_folder_id(self, folder: str) -> str:
-        query = f"name = '{folder}' and mimeType = 'application/vnd.google-apps.folder'"
+        """
+        Id of the folder named folder, or False if there is none. Ids are cached in the state file; a cached id is
+        checked once per run and looked up again if the folder was deleted, trashed or renamed since.
+        """
+        folder_ids = self.state["folder_ids"]
+        cached = folder_ids.get(folder)
+        if cached is not None:
+            if cached in self._checked_folder_ids or self._is_folder(cached, folder):
+                self._checked_folder_ids.add(cached)
+                return cached
+            print(f"Cached id of folder '{folder}' is stale, looking it up again.")
+            del folder_ids[folder]
+            self._save_state()
+        query = f"name = '{folder}' and mimeType = '{FOLDER_MIME_TYPE}'"
         found = self._get_files_list_response(query)
         if len(found) == 0:
             return False
         result = found[0].get("id")
+        folder_ids[folder] = result
+        self._checked_folder_ids.add(result)
+        self._save_state()
         return result
 
     def list_files_from_folder(self, folder: str) -> list[dict]:
@@ -58,31 +137,157 @@ class CCGPDrive:
         found = self._get_files_list_response(query)
         return found
 
-    def download_files(self, *files: dict) -> None:
-        """Downloads files to current directory."""
-        for file in files:
-            if Path(file["name"]).exists():
-                print(
-                    "File: "
-                    + "'"
-                    + file["name"]
-                    + "'"
-                    + " already exists, skipping download."
-                )
-                continue
-            if file.get("mimeType") == "application/vnd.google-apps.spreadsheet":
-                request = self.service.files().export_media(
-                    fileId=file.get("id"), mimeType="text/tab-separated-values"
+    def get_start_page_token(self) -> str:
+        """Token for the current position in the Drive changes feed."""
+        response = self.service.changes().getStartPageToken(supportsAllDrives=True).execute()
+        return response["startPageToken"]
+
+    def _changed_files(self, page_token: str) -> tuple[list[dict], str]:
+        """Files added, modified or moved since page_token (not removed/trashed), and the token to continue from."""
+        changed = {}
+        while True:
+            response = (
+                self.service.changes()
+                .list(
+                    pageToken=page_token,
+                    spaces="drive",
+                    includeItemsFromAllDrives=True,
+                    supportsAllDrives=True,
+                    fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}, parents, trashed))",
                 )
-                file["name"]
+                .execute()
+            )
+            for change in response.get("changes", []):
+                file = change.get("file")
+                if change.get("removed") or file is None or file.get("trashed"):
+                    changed.pop(change["fileId"], None)
+                else:
+                    changed[change["fileId"]] = file
+            if "newStartPageToken" in response:
+                return list(changed.values()), response["newStartPageToken"]
+            page_token = response["nextPageToken"]
+
+    def list_changed_files(self, *folders: str, key: str) -> tuple[dict, str]:
+        """
+        Returns ({folder: [files added or modified since the last run]}, page token) for the folders.
+
+        key names the stored page token, so different jobs each keep their own place in the changes feed. Without
+        a stored token (first run) every file in the folders is listed. Pass the returned token to save_page_token
+        once the files have been handled; until then the next call sees the same changes again.
+        """
+        stored = self.state["page_tokens"].get(key)
+        if stored is None:
+            token = self.get_start_page_token()  # Taken before listing, so nothing added meanwhile is missed.
+            return {folder: self.list_files_from_folder(folder) for folder in folders}, token
+
+        files, token = self._changed_files(stored)
+        folder_ids = {self.get_folder_id(folder): folder for folder in folders}
+        found = {folder: [] for folder in folders}
+        for file in files:
+            for parent in file.pop("parents", []):
+                if parent in folder_ids:
+                    found[folder_ids[parent]].append(file)
+            file.pop("trashed", None)
+        return found, token
+
+    def save_page_token(self, key: str, token: str) -> None:
+        """Stores where list_changed_files(key=key) continues from on the next run."""
+        self.state["page_tokens"][key] = token
+        self._save_state()
+
+    def download_file(
+        self,
+        file: dict,
+        dest_dir=".",
+        chunk_size: int = DOWNLOAD_CHUNK_SIZE,
+        retries: int = DOWNLOAD_RETRIES,
+        backoff: float = 1.0,
+        dest_by_id: bool = False,
+    ) -> Path:
+        """
+        Downloads one file (exporting Google Sheets as TSV) to dest_dir and returns its path. With dest_by_id it
+        goes to "<dest_dir>/<file id>/<name>" instead, so different files with the same name don't collide.
+
+        Chunks are written to a uniquely named "<name>.<random>.part" next to it, which is moved into place only
+        once complete, so an interrupted download never leaves a truncated file behind and concurrent downloads
+        never write to the same temp file.
+        Failed chunks are retried with exponential backoff, resuming from the last complete chunk.
+        """
+        path = Path(dest_dir, file["id"], file["name"]) if dest_by_id else Path(dest_dir, file["name"])
+        if path.exists():
+            print("File: " + "'" + file["name"] + "'" + " already exists, skipping download.")
+            return path
+        service = self._thread_service()
+        if file.get("mimeType") == "application/vnd.google-apps.spreadsheet":
+            request = service.files().export_media(
+                fileId=file.get("id"), mimeType="text/tab-separated-values"
+            )
+        else:
+            request = service.files().get_media(fileId=file.get("id"))
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        print("Downloading file " + "'" + file["name"] + "," + file["id"] + "'")
+        fh = tempfile.NamedTemporaryFile(dir=path.parent, prefix=path.name + ".", suffix=".part", delete=False)
+        part = Path(fh.name)
+        try:
+            with fh:
+                downloader = MediaIoBaseDownload(fh, request, chunksize=chunk_size)
+                done, attempt = False, 0
+                while done is False:
+                    try:
+                        _, done = downloader.next_chunk(num_retries=retries)
+                        attempt = 0
+                    except (HttpError, OSError) as e:
+                        if isinstance(e, HttpError) and e.resp.status not in RETRY_STATUSES:
+                            raise
+                        attempt += 1
+                        if attempt > retries:
+                            raise
+                        delay = backoff * 2 ** (attempt - 1)
+                        print(f"Retrying download of '{file['name']}' in {delay:.0f}s: {e}")
+                        time.sleep(delay)
+            os.replace(part, path)
+        except BaseException:
+            part.unlink(missing_ok=True)
+            raise
+        return path
+
+    def iter_downloads(self, files, max_workers: int = DOWNLOAD_WORKERS, **kwargs):
+        """
+        Downloads files on a pool of max_workers threads and yields (file, path) as each one finishes, or
+        (file, exception) if it failed, so one bad file doesn't stop the rest. kwargs go to download_file.
+
+        Without dest_by_id, different files with the same name would land on the same path, so that raises a
+        ValueError before anything is downloaded.
+        """
+        files = list(files)
+        if not kwargs.get("dest_by_id"):
+            ids_by_name = {}
+            for file in files:
+                ids_by_name.setdefault(file["name"], set()).add(file["id"])
+            clashes = sorted(name for name, ids in ids_by_name.items() if len(ids) > 1)
+            if clashes:
+                raise ValueError(f"Different files share a name, download them with dest_by_id=True: {clashes}")
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            futures = {pool.submit(self.download_file, file, **kwargs): file for file in files}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except Exception as e:
+                    yield futures[future], e
+
+    def download_files(self, *files: dict, **kwargs) -> list[Path]:
+        """Downloads files to current directory (or dest_dir) concurrently. Raises the first error once all are done."""
+        paths = {}
+        errors = []
+        for file, result in self.iter_downloads(files, **kwargs):
+            if isinstance(result, Exception):
+                errors.append(result)
             else:
-                request = self.service.files().get_media(fileId=file.get("id"))
-            fh = io.FileIO(file.get("name"), "wb")
-            downloader = MediaIoBaseDownload(fh, request)
-            done = False
-            print("Downloading file " + "'" + file["name"] + "," + file["id"] + "'")
-            while done is False:
-                status, done = downloader.next_chunk()
+                paths[file["id"]] = result
+        if errors:
+            raise errors[0]
+        return [paths[file["id"]] for file in files]
 
     def upload_file(
         self, file: Path, folder_name: str = None, folder_id: str = None
@@ -0,0 +1,132 @@
+"""On-disk cache in front of reverse geocoding so reruns and co-located samples don't hit Nominatim again."""
+import json
+import sqlite3
+import time
+from os import getenv
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+DEFAULT_CACHE = Path(__file__).parent / "geocode_cache.sqlite3"
+
+
+class CachedLocation:
+    """Stand-in for geopy's Location for results served from the cache; only `.raw` is used."""
+
+    def __init__(self, raw: dict) -> None:
+        self.raw = raw
+
+
+class GeocodeCache:
+    """
+    SQLite cache of reverse geocoding results keyed by (lat, long) rounded to `precision` decimals.
+
+    Expired and least recently used entries are evicted when the cache is opened and then every evict_every
+    inserts, so in between it can run over max_entries by at most evict_every entries.
+    """
+
+    def __init__(
+        self,
+        path=None,
+        precision: int = 4,
+        ttl_days: float = 180,
+        max_entries: int = 100000,
+        evict_every: int = 1000,
+    ) -> None:
+        load_dotenv()
+        self.path = Path(path or getenv("geocode_cache") or DEFAULT_CACHE)
+        self.precision = precision
+        self.ttl = ttl_days * 24 * 60 * 60
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self._inserts = 0
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        with self.conn:
+            self.conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS reverse (
+                    lat REAL, long REAL, raw TEXT, created_at REAL, accessed_at REAL,
+                    PRIMARY KEY (lat, long)
+                );
+                CREATE INDEX IF NOT EXISTS reverse_created_at ON reverse (created_at);
+                CREATE INDEX IF NOT EXISTS reverse_accessed_at ON reverse (accessed_at);
+                """
+            )
+        self.evict()
+
+    def _key(self, lat: float, long: float) -> tuple[float, float]:
+        return round(lat, self.precision), round(long, self.precision)
+
+    def get(self, lat: float, long: float):
+        """Returns (hit, raw). raw is None for a cached "no location found"."""
+        key = self._key(lat, long)
+        row = self.conn.execute(
+            "SELECT raw, created_at FROM reverse WHERE lat = ? AND long = ?", key
+        ).fetchone()
+        now = time.time()
+        if row is None or now - row[1] > self.ttl:
+            return False, None
+        with self.conn:
+            self.conn.execute(
+                "UPDATE reverse SET accessed_at = ? WHERE lat = ? AND long = ?", (now, *key)
+            )
+        return True, json.loads(row[0])
+
+    def set(self, lat: float, long: float, raw) -> None:
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO reverse VALUES (?, ?, ?, ?, ?)",
+                (*self._key(lat, long), json.dumps(raw), now, now),
+            )
+        self._inserts += 1
+        if self._inserts % self.evict_every == 0:
+            self.evict()
+
+    def evict(self) -> None:
+        """Drops expired entries, then the least recently used ones above max_entries."""
+        with self.conn:
+            self.conn.execute("DELETE FROM reverse WHERE created_at < ?", (time.time() - self.ttl,))
+            self.conn.execute(
+                """
+                DELETE FROM reverse WHERE rowid IN (
+                    SELECT rowid FROM reverse ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,),
+            )
+
+
+class CachedReverseGeocoder:
+    """
+    Reverse geocoder with the same `reverse` call as geopy's, backed by GeocodeCache.
+
+    backend can be any object with a geopy-style reverse((lat, long), exactly_one=True) returning something
+    with `.raw` (or None), e.g. a local stub in tests. Defaults to Nominatim, throttled to min_delay seconds
+    between live requests per its usage policy.
+    """
+
+    def __init__(self, backend=None, cache: GeocodeCache = None, min_delay: float = 1.0) -> None:
+        if backend is None:
+            from geopy.geocoders import Nominatim
+
+            backend = Nominatim(user_agent="CCGP Data Wrangling Script", timeout=10)
+        self.backend = backend
+        self.cache = cache if cache is not None else GeocodeCache()
+        self.min_delay = min_delay
+        self._last_request = 0.0
+
+    def reverse(self, point, exactly_one: bool = True):
+        lat, long = point
+        hit, raw = self.cache.get(lat, long)
+        if not hit:
+            wait = self._last_request + self.min_delay - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            location = self.backend.reverse((lat, long), exactly_one=exactly_one)
+            self._last_request = time.monotonic()
+            raw = location.raw if location else None
+            self.cache.set(lat, long, raw)
+        if raw is None:
+            return None
+        return CachedLocation(raw)
@@ -1,54 +1,156 @@
 import pygsheets
+from pygsheets.utils import numericise_all
 import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
+from pathlib import Path
 import os
+import threading
+import time
 
 """Classes and functions for interacting with Google Sheets."""
 
+DEFAULT_TTL = 15 * 60  # Seconds a fetched worksheet is reused before it is fetched again.
+# Worksheets the methods below read. They are fetched together, in one values.batchGet request.
+TABS = (
+    "ReferenceProgress",
+    "ExpectedWGSbySpeciesProject",
+    "CCGPSpeciesSubspeciesList",
+    "RAW-PGL CCGP Assemblies status",
+)
+
+# Process-level caches shared by every WGSTracking instance. Cached frames are never modified; callers get copies.
+_lock = threading.RLock()
+_spreadsheets = {}
+_frames = {}  # worksheet title -> (fetched_at, DataFrame)
+_columns = {}  # (worksheet title, column, index) -> (fetched_at, Series)
+_lookups = {}  # (worksheet title, column, index) -> (fetched_at, {index: value})
+
 
 class WGSTracking:
-    """Class for getting data from WGSTracking sheet."""
+    """
+    Class for getting data from WGSTracking sheet.
 
-    def __init__(self) -> None:
+    Worksheets are fetched once per process and reused for ttl seconds (env `wgs_cache_ttl`, default 15 minutes),
+    and the spreadsheet is only opened when something actually has to be fetched. With a snapshot_dir (env
+    `wgs_snapshot_dir`), fetched worksheets are also pickled there so other processes within the ttl skip the API.
+    All of TABS are fetched in a single request whenever any of them is needed, and every method is safe to call
+    from several threads at once.
+    """
+
+    def __init__(self, ttl: float = None, snapshot_dir=None) -> None:
         load_dotenv()
-        gc = pygsheets.authorize(
-            service_file=os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
-        )
-        self.sh = gc.open("WGSTracking")
-
-    def _get_column_as_series(self, column: str, index="SpeciesProjectID") -> pd.Series:
-        self.df.replace(
-            r"^\s*$", np.nan, regex=True, inplace=True
-        )  # Replace whitespace with nans to then remove them
-        self.df.set_index(index, inplace=True)
-        series = self.df[column]
-        series = series.dropna()
-        return series
+        self.ttl = float(ttl if ttl is not None else os.environ.get("wgs_cache_ttl", DEFAULT_TTL))
+        snapshot_dir = snapshot_dir or os.environ.get("wgs_snapshot_dir")
+        self.snapshot_dir = Path(snapshot_dir) if snapshot_dir else None
+
+    @property
+    def sh(self):
+        if "WGSTracking" not in _spreadsheets:
+            gc = pygsheets.authorize(
+                service_file=os.environ.get("GOOGLE_APPLICATION_CREDENTIALS")
+            )
+            _spreadsheets["WGSTracking"] = gc.open("WGSTracking")
+        return _spreadsheets["WGSTracking"]
+
+    def _snapshot_path(self, title: str) -> Path:
+        return self.snapshot_dir / f"{title}.pkl"
+
+    def _fresh(self, title: str, now: float):
+        """Cached (fetched_at, DataFrame) of a worksheet if younger than the ttl, loading a snapshot if need be."""
+        cached = _frames.get(title)
+        if cached is not None and now - cached[0] < self.ttl:
+            return cached
+        if self.snapshot_dir is not None:
+            path = self._snapshot_path(title)
+            if path.exists() and now - path.stat().st_mtime < self.ttl:
+                _frames[title] = (path.stat().st_mtime, pd.read_pickle(path))
+                return _frames[title]
+        return None
+
+    @staticmethod
+    def _values_to_df(values: list) -> pd.DataFrame:
+        """DataFrame from a worksheet's cell values, the same way pygsheets' get_as_df builds it."""
+        if not values:
+            return pd.DataFrame()
+        width = max(len(row) for row in values)
+        values = [numericise_all(row + [""] * (width - len(row)), "") for row in values]
+        return pd.DataFrame(values[1:], columns=values[0])
+
+    def load(self, *titles: str) -> None:
+        """Fetches every worksheet in titles (default: TABS) that isn't cached, all in one values.batchGet request."""
+        titles = titles or TABS
+        with _lock:
+            now = time.time()
+            stale = [title for title in titles if self._fresh(title, now) is None]
+            if not stale:
+                return
+            sh = self.sh
+            ranges = ["'" + title.replace("'", "''") + "'" for title in stale]
+            value_ranges = sh.client.sheet.values_batch_get(sh.id, ranges)
+            for title, value_range in zip(stale, value_ranges):
+                df = self._values_to_df(value_range.get("values", []))
+                _frames[title] = (now, df)
+                if self.snapshot_dir is not None:
+                    self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+                    path = self._snapshot_path(title)
+                    tmp = path.with_name(path.name + ".tmp")
+                    df.to_pickle(tmp)
+                    os.replace(tmp, path)
+
+    def _worksheet_df(self, title: str) -> tuple[float, pd.DataFrame]:
+        """(fetched_at, DataFrame) of a worksheet. A miss refreshes all stale TABS at once."""
+        with _lock:
+            cached = self._fresh(title, time.time())
+            if cached is None:
+                self.load(*dict.fromkeys([title, *TABS]))
+                cached = _frames[title]
+            return cached
+
+    def worksheet(self, title: str) -> pd.DataFrame:
+        """A copy of a worksheet's DataFrame."""
+        return self._worksheet_df(title)[1].copy()
+
+    def _get_column_as_series(self, title: str, column: str, index="SpeciesProjectID") -> pd.Series:
+        """A worksheet column indexed by `index`, without blanks; rebuilt only when the worksheet is fetched again."""
+        fetched_at, df = self._worksheet_df(title)
+        key = (title, column, index)
+        cached = _columns.get(key)
+        if cached is None or cached[0] != fetched_at:
+            df = df.replace(r"^\s*$", np.nan, regex=True)  # Replace whitespace with nans to then remove them
+            series = df.set_index(index)[column].dropna()
+            cached = _columns[key] = (fetched_at, series)
+        return cached[1].copy()
+
+    def _lookup(self, title: str, column: str, index="SpeciesProjectID") -> dict:
+        """{index: str(value)} for a worksheet column, for repeated single lookups."""
+        fetched_at, _ = self._worksheet_df(title)
+        key = (title, column, index)
+        cached = _lookups.get(key)
+        if cached is None or cached[0] != fetched_at:
+            series = self._get_column_as_series(title, column, index).astype("str")
+            cached = _lookups[key] = (fetched_at, series.to_dict())
+        return cached[1]
 
     def reference_progress(self) -> pd.Series:
-        wks = self.sh.worksheet_by_title("ReferenceProgress")
-        self.df = wks.get_as_df()
-        series = self._get_column_as_series("ReferenceStage")
+        series = self._get_column_as_series("ReferenceProgress", "ReferenceStage")
         return series
 
     def expected_count(self) -> pd.Series:
-        wks = self.sh.worksheet_by_title("ExpectedWGSbySpeciesProject")
-        self.df = wks.get_as_df()
-        series = self._get_column_as_series("sample number of species project")
+        series = self._get_column_as_series(
+            "ExpectedWGSbySpeciesProject", "sample number of species project"
+        )
         return series
 
     def project_type(self) -> pd.Series:
-        wks = self.sh.worksheet_by_title("CCGPSpeciesSubspeciesList")
-        self.df = wks.get_as_df()
-        series = self._get_column_as_series("NCBI Template", index="Species-project")
+        series = self._get_column_as_series(
+            "CCGPSpeciesSubspeciesList", "NCBI Template", index="Species-project"
+        )
         return series
 
     def reference_accession(self, project_id: str) -> pd.Series:
-        wks = self.sh.worksheet_by_title("RAW-PGL CCGP Assemblies status")
-        self.df = wks.get_as_df()
-        series = self._get_column_as_series("NCBI Genome accession primary").astype(
-            "str"
+        accessions = self._lookup(
+            "RAW-PGL CCGP Assemblies status", "NCBI Genome accession primary"
         )
-        accession = series.get(project_id, default="NaN")
+        accession = accessions.get(project_id, "NaN")
         return accession
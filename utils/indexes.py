@@ -0,0 +1,109 @@
+"""
+Indexes the ccgp_dev collections need, and a check that the scripts' hot queries actually use them.
+
+To run script (from the repo root):
+    python3 -m utils.indexes
+Creates any missing indexes, then exits non-zero if a hot query still reads a whole collection or index.
+"""
+import sys
+import pymongo
+from pymongo import IndexModel
+from pymongo.errors import OperationFailure
+from utils.db import get_mongo_client
+
+INDEXES = {
+    "sample_metadata": [
+        IndexModel([("*sample_name", pymongo.ASCENDING)]),
+        IndexModel([("ccgp-project-id", pymongo.ASCENDING), ("*sample_name", pymongo.ASCENDING)]),
+        # update_reads_by_lane matches lane names anywhere in the field, so this index is scanned in full; that is
+        # still cheaper than a COLLSCAN, but the query isn't one of HOT_QUERIES.
+        IndexModel([("lane_name", pymongo.ASCENDING)]),
+    ],
+    "reads": [
+        IndexModel([("file_name", pymongo.ASCENDING)], unique=True),
+    ],
+    "parsed_metadata_files": [
+        IndexModel([("file_name", pymongo.ASCENDING)]),
+    ],
+    "workflow_progress": [
+        IndexModel([("project_id", pymongo.ASCENDING)]),
+    ],
+}
+
+# (collection, filter) pairs the scripts run per sample/file or per project.
+HOT_QUERIES = [
+    ("sample_metadata", {"*sample_name": "x"}),
+    ("sample_metadata", {"ccgp-project-id": "x"}),
+    ("reads", {"file_name": "x"}),
+    ("reads", {"file_name": {"$in": ["x", "y"]}}),
+    ("parsed_metadata_files", {"file_name": "x"}),
+    ("workflow_progress", {"project_id": "x"}),
+]
+
+# Index bounds of a field that isn't narrowed down at all: any value, or any string (e.g. an unanchored regex).
+UNBOUNDED_RANGES = {"[MinKey, MaxKey]", '["", {})'}
+
+
+def ensure_indexes(db) -> list[str]:
+    """Creates any missing indexes from INDEXES. Returns names of the indexes that exist afterwards."""
+    names = []
+    for collection, models in INDEXES.items():
+        try:
+            names.extend(db[collection].create_indexes(models))
+        except OperationFailure as e:  # e.g. duplicate file_names block the unique index on reads.
+            print(f"Could not create indexes on {collection}: {e.details.get('errmsg', e)}")
+    return names
+
+
+def _stages(plan: dict):
+    """Yields every stage in an explain plan tree."""
+    if "stage" in plan:
+        yield plan
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+def scan_problems(collection, query: dict) -> list[str]:
+    """
+    Stages of MongoDB's winning plan for query that read a whole collection (COLLSCAN) or a whole index (IXSCAN
+    whose leading field is unbounded).
+    """
+    explain = collection.find(query).explain()
+    problems = []
+    for stage in _stages(explain["queryPlanner"]["winningPlan"]):
+        if stage["stage"] == "COLLSCAN":
+            problems.append("COLLSCAN")
+        elif stage["stage"] == "IXSCAN":
+            leading = next(iter(stage.get("indexBounds", {}).values()), [])
+            if UNBOUNDED_RANGES.intersection(leading):
+                problems.append(f"unbounded IXSCAN of {stage.get('indexName')}")
+    return problems
+
+
+def check_query_plans(db) -> list[str]:
+    """Returns a description of every hot query that reads a whole collection or index."""
+    failures = []
+    for collection, query in HOT_QUERIES:
+        problems = scan_problems(db[collection], query)
+        if problems:
+            failures.append(f"{collection}: {query} ({', '.join(problems)})")
+    return failures
+
+
+def main():
+    db = get_mongo_client()["ccgp_dev"]
+    print(f"Indexes: {ensure_indexes(db)}")
+    failures = check_query_plans(db)
+    if failures:
+        print("These queries read a whole collection or index:")
+        for failure in failures:
+            print(f"    {failure}")
+        sys.exit(1)
+    print("All hot queries use bounded index scans.")
+
+
+if __name__ == "__main__":
+    main()
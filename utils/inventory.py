@@ -0,0 +1,309 @@
+"""
+Local SQLite manifest of the ccgp bucket so scripts don't have to re-list every object on every run.
+
+The manifest is split into shards: the bucket root ("") plus every top-level "/" prefix. An incremental refresh
+lists the whole root with a delimiter, which finds every top-level prefix, and writes only the root objects whose
+ETag or LastModified changed. Each prefix shard keeps a cursor (the last key seen) and only its keys after the
+cursor are listed; prefixes that are new are listed in full, and so are prefixes that were explicitly marked as
+changed (the download workflow's sync rule does this, and fails if it can't). Other keys that land before a
+prefix's cursor, and deletions under a prefix, are picked up by the periodic full sync, which lists key ranges in
+parallel with list_objects_parallel.
+
+To run script:
+    python3 inventory.py refresh [--full]
+    python3 inventory.py mark-changed <prefix> [<prefix> ...]
+"""
+import argparse
+import queue
+import sqlite3
+import string
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from os import getenv
+from pathlib import Path
+
+import boto3
+from dotenv import load_dotenv
+
+BUCKET = "ccgp"
+DEFAULT_MANIFEST = Path(__file__).parent / "s3_inventory.sqlite3"
+DEFAULT_FULL_SYNC_HOURS = 24 * 7
+# Keys are split into lexicographic ranges on these leading characters for parallel listing.
+SHARD_BOUNDARIES = string.digits + string.ascii_uppercase + string.ascii_lowercase
+
+S3Object = namedtuple("S3Object", ["key", "size", "etag", "last_modified"])
+
+
+def get_s3_client():
+    """Utility function to get S3 client for the ccgp endpoint."""
+    load_dotenv()
+    return boto3.client(
+        "s3",
+        aws_access_key_id=getenv("aws_access_key_id"),
+        aws_secret_access_key=getenv("aws_secret_access_key"),
+        endpoint_url=getenv("endpoint_url"),
+    )
+
+
+def shard_of(key: str) -> str:
+    """Top-level prefix a key lives under, or "" for keys at the bucket root."""
+    if "/" in key:
+        return key.split("/", 1)[0] + "/"
+    return ""
+
+
+def list_root(client, bucket: str = BUCKET) -> tuple[list, list[str]]:
+    """Objects at the bucket root (as S3Objects) and the top-level "/" prefixes, from one delimiter listing."""
+    objects, prefixes = [], []
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Delimiter="/"):
+        objects.extend(map(_to_s3_object, page.get("Contents", [])))
+        prefixes.extend(p["Prefix"] for p in page.get("CommonPrefixes", []))
+    return objects, prefixes
+
+
+def discover_prefixes(client, bucket: str = BUCKET) -> list[str]:
+    """Top-level "/" prefixes of the bucket, found with a delimiter listing."""
+    return list_root(client, bucket)[1]
+
+
+def _to_s3_object(obj: dict) -> S3Object:
+    return S3Object(obj["Key"], obj["Size"], obj.get("ETag"), obj["LastModified"])
+
+
+_DONE = object()
+
+
+def list_objects_parallel(client=None, bucket: str = BUCKET, max_workers: int = 8, boundaries=None):
+    """
+    Yields every object in the bucket as an S3Object while the listing is still running.
+
+    The keyspace is cut into ranges (lo, hi] on the given boundaries and each range is listed by its own
+    thread with StartAfter=lo, so objects come back in no particular order. By default the boundaries are the
+    top-level prefixes from discover_prefixes, so each folder is listed on its own, plus SHARD_BOUNDARIES to split
+    up the keys at the bucket root.
+    """
+    if client is None:
+        client = get_s3_client()
+    if boundaries is None:
+        boundaries = [*discover_prefixes(client, bucket), *SHARD_BOUNDARIES]
+    boundaries = sorted(set(boundaries))
+    ranges = list(zip([None, *boundaries], [*boundaries, None]))
+    results = queue.Queue(maxsize=64)
+    stop = threading.Event()
+
+    def put(item) -> None:
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def list_range(lo: str, hi: str) -> None:
+        try:
+            paginator = client.get_paginator("list_objects_v2")
+            kwargs = {"StartAfter": lo} if lo else {}
+            for page in paginator.paginate(Bucket=bucket, **kwargs):
+                contents = page.get("Contents", [])
+                batch = [obj for obj in contents if hi is None or obj["Key"] <= hi]
+                if batch:
+                    put(batch)
+                if len(batch) < len(contents) or stop.is_set():  # Walked past the end of this range.
+                    break
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for lo, hi in ranges:
+            pool.submit(list_range, lo, hi)
+        remaining = len(ranges)
+        while remaining:
+            item = results.get()
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                for obj in item:
+                    yield _to_s3_object(obj)
+    finally:
+        stop.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+class S3Inventory:
+    """Persisted (key, size, ETag, last_modified) manifest of an S3 bucket."""
+
+    def __init__(self, path=None, bucket: str = BUCKET, client=None, full_sync_hours=None) -> None:
+        load_dotenv()
+        self.path = Path(path or getenv("s3_manifest") or DEFAULT_MANIFEST)
+        self.bucket = bucket
+        self._client = client
+        if full_sync_hours is None:
+            full_sync_hours = getenv("s3_full_sync_hours", DEFAULT_FULL_SYNC_HOURS)
+        self.full_sync_every = timedelta(hours=float(full_sync_hours))
+        self.conn = sqlite3.connect(self.path, timeout=60)
+        with self.conn:
+            self.conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS objects (
+                    key TEXT PRIMARY KEY, size INTEGER, etag TEXT, last_modified TEXT, shard TEXT
+                );
+                CREATE INDEX IF NOT EXISTS objects_shard ON objects (shard);
+                CREATE TABLE IF NOT EXISTS shards (shard TEXT PRIMARY KEY, cursor TEXT, synced_at TEXT);
+                CREATE TABLE IF NOT EXISTS changed (prefix TEXT PRIMARY KEY);
+                CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT);
+                """
+            )
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_s3_client()
+        return self._client
+
+    def _pages(self, **kwargs):
+        paginator = self.client.get_paginator("list_objects_v2")
+        yield from paginator.paginate(Bucket=self.bucket, **kwargs)
+
+    def _save(self, objects) -> int:
+        rows = [
+            (obj.key, obj.size, obj.etag, obj.last_modified.isoformat(), shard_of(obj.key))
+            for obj in objects
+        ]
+        self.conn.executemany("INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def _set_cursor(self, shard: str, cursor: str, now: str) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO shards VALUES (?, ?, ?)", (shard, cursor, now)
+        )
+
+    def _sync_root(self) -> tuple[int, list[str]]:
+        """
+        Lists the whole bucket root and writes the root objects that are new or whose ETag or LastModified changed,
+        and drops the ones that are gone. Returns (# written, top-level prefixes).
+        """
+        objects, prefixes = list_root(self.client, self.bucket)
+        known = {
+            key: (etag, last_modified)
+            for key, etag, last_modified in self.conn.execute(
+                "SELECT key, etag, last_modified FROM objects WHERE shard = ''"
+            )
+        }
+        changed = [obj for obj in objects if known.get(obj.key) != (obj.etag, obj.last_modified.isoformat())]
+        gone = known.keys() - {obj.key for obj in objects}
+        self.conn.executemany("DELETE FROM objects WHERE key = ?", [(key,) for key in gone])
+        return self._save(changed), prefixes
+
+    def _sync_prefix(self, prefix: str, cursor: str = None) -> tuple[int, str]:
+        """Lists keys under prefix after cursor. Returns (# saved, new cursor)."""
+        kwargs = {"Prefix": prefix}
+        if cursor:
+            kwargs["StartAfter"] = cursor
+        saved = 0
+        for page in self._pages(**kwargs):
+            contents = page.get("Contents", [])
+            saved += self._save(map(_to_s3_object, contents))
+            if contents:
+                cursor = max(cursor or "", contents[-1]["Key"])
+        return saved, cursor
+
+    def _full_sync_due(self) -> bool:
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'last_full_sync'").fetchone()
+        if row is None:
+            return True
+        last = datetime.fromisoformat(row[0])
+        return datetime.now(timezone.utc) - last >= self.full_sync_every
+
+    def _full_sync(self, now: str, max_workers: int) -> int:
+        """Re-lists the whole bucket in parallel and rebuilds the shard cursors from what was seen."""
+        self.conn.execute("DELETE FROM objects")
+        self.conn.execute("DELETE FROM shards")
+        saved, batch = 0, []
+        for obj in list_objects_parallel(self.client, self.bucket, max_workers=max_workers):
+            batch.append(obj)
+            if len(batch) >= 10000:
+                saved += self._save(batch)
+                batch = []
+        saved += self._save(batch)
+        self.conn.execute(
+            "INSERT INTO shards SELECT shard, max(key), ? FROM objects GROUP BY shard", (now,)
+        )
+        self.conn.execute("INSERT OR IGNORE INTO shards VALUES ('', NULL, ?)", (now,))
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('last_full_sync', ?)", (now,))
+        return saved
+
+    def mark_changed(self, *prefixes: str) -> None:
+        """Marks key prefixes to be fully re-listed on the next refresh."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO changed VALUES (?)", [(p,) for p in prefixes]
+            )
+
+    def refresh(self, full: bool = False, max_workers: int = 8) -> int:
+        """Brings the manifest up to date with the bucket. Returns the number of objects (re)written."""
+        full = full or self._full_sync_due()
+        now = datetime.now(timezone.utc).isoformat()
+        cursors = dict(self.conn.execute("SELECT shard, cursor FROM shards"))
+        saved = 0
+        with self.conn:
+            if full:
+                saved += self._full_sync(now, max_workers)
+            else:
+                n, prefixes = self._sync_root()
+                saved += n
+                self._set_cursor("", None, now)
+                for prefix in set(prefixes) | (set(cursors) - {""}):  # Prefixes without a cursor are listed in full.
+                    n, cursor = self._sync_prefix(prefix, cursors.get(prefix))
+                    saved += n
+                    self._set_cursor(prefix, cursor, now)
+
+            for (prefix,) in self.conn.execute("SELECT prefix FROM changed").fetchall():
+                self.conn.execute(
+                    "DELETE FROM objects WHERE substr(key, 1, ?) = ?", (len(prefix), prefix)
+                )
+                n, _ = self._sync_prefix(prefix)
+                saved += n
+            self.conn.execute("DELETE FROM changed")
+        print(f"{'Full' if full else 'Incremental'} S3 inventory refresh wrote {saved} objects.")
+        return saved
+
+    def objects(self):
+        """Yields every object in the manifest as an S3Object."""
+        for key, size, etag, last_modified in self.conn.execute(
+            "SELECT key, size, etag, last_modified FROM objects ORDER BY key"
+        ):
+            yield S3Object(key, size, etag, datetime.fromisoformat(last_modified))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparser = parser.add_subparsers(
+        dest="command", title="subcommands", description="valid subcommands"
+    )
+    refresh = subparser.add_parser("refresh", description="Refresh the manifest")
+    refresh.add_argument(
+        "--full", action="store_true", help="Re-list the whole bucket instead of only what changed"
+    )
+    changed = subparser.add_parser(
+        "mark-changed", description="Re-list these key prefixes on the next refresh"
+    )
+    changed.add_argument("prefixes", nargs="+")
+    args = parser.parse_args()
+
+    inventory = S3Inventory()
+    if args.command == "refresh":
+        inventory.refresh(full=args.full)
+    elif args.command == "mark-changed":
+        inventory.mark_changed(*args.prefixes)
+
+
+if __name__ == "__main__":
+    main()
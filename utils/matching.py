@@ -0,0 +1,100 @@
+"""Fast lookups of sample sequence ids in the file names of the reads collection."""
+import logging
+
+SUFFIXES = ("_", "-", ".")
+
+
+def seq_id_queries(seq_id) -> set[str]:
+    """
+    Every query string the update_reads scripts may try for one minicore sequence id: update_reads tries each
+    comma-separated id, update_reads_by_lane the whole string.
+    """
+    seq_id = str(seq_id)
+    if seq_id.lower() == "nan":
+        return set()
+    queries = set()
+    for q in {seq_id, *seq_id.split(",")}:
+        queries.update(
+            {
+                q,
+                q.replace("_", "-"),
+                q.replace("-", ""),
+                q.replace("_", "-").replace("-", ""),
+                q.replace("-", "_"),
+            }
+        )
+    queries.discard("")
+    return queries
+
+
+class ReadsAutomaton:
+    """Aho-Corasick automaton over a fixed set of queries, run once over every read file name.
+
+    After construction, `find` is a dict lookup for any compiled query and gives the same result as checking
+    every file name. Build it with every query from seq_id_queries; a query that was not compiled is logged and
+    falls back to that scan of all files.
+    """
+
+    def __init__(self, files: list[dict], queries) -> None:
+        self.files = files
+        self.queries = sorted(set(queries))
+        self.query_ids = {q: pid for pid, q in enumerate(self.queries)}
+        self._build()
+        self.hits = self._scan()
+
+    def _build(self) -> None:
+        goto = [{}]
+        out = [[]]
+        for pid, q in enumerate(self.queries):
+            state = 0
+            for ch in q:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                state = nxt
+            out[state].append(pid)
+
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())  # Children of the root fail back to the root.
+        for state in queue:  # Breadth first, so fail links always point to finished states.
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+        self.goto, self.fail, self.out = goto, fail, out
+
+    def _scan(self) -> list[list[int]]:
+        """Single pass over all file names. Returns, per query, the indices of files containing it."""
+        goto, fail, out = self.goto, self.fail, self.out
+        hits = [[] for _ in self.queries]
+        for i, file in enumerate(self.files):
+            state = 0
+            for ch in file["file_name"]:
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                state = goto[state].get(ch, 0)
+                for pid in out[state]:
+                    pid_hits = hits[pid]
+                    if not pid_hits or pid_hits[-1] != i:
+                        pid_hits.append(i)
+        return hits
+
+    def find(self, q: str, suffixes: tuple = SUFFIXES) -> list[dict]:
+        """Returns files whose name contains q followed by any of suffixes."""
+        patterns = [f"{q}{s}" for s in suffixes]
+        try:
+            candidates = self.hits[self.query_ids[q]]
+        except KeyError:
+            logging.warning(f" Query {q!r} is not in the reads automaton, scanning all {len(self.files)} files")
+            candidates = range(len(self.files))
+        return [
+            self.files[i]
+            for i in candidates
+            if any(p in self.files[i]["file_name"] for p in patterns)
+        ]
@@ -0,0 +1,133 @@
+"""Column rules shared by the scripts that build NCBI BioSample/SRA submission sheets."""
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+# Read token (_R1/_R2) of an Illumina file name, e.g. samp_a1_L001_R1_001.fastq.gz. Whatever surrounds it,
+# including the lane (_L001), has to match for two files to be mates. The leading .* makes it the last token, so
+# sample names that contain one themselves (CA_R1_S1_R1_001.fastq.gz) still pair on the real read number.
+READ_TOKEN = re.compile(r".*_R(?P<read>[12])(?=[._])")
+
+
+def _column(df: pd.DataFrame, name: str) -> pd.Series:
+    if name in df.columns:
+        return df[name]
+    return pd.Series(np.nan, index=df.index, dtype=object)
+
+
+def is_blank(values: pd.Series) -> pd.Series:
+    """pd.isnull(x) or x == "" for every value."""
+    return values.isna() | (values == "")
+
+
+def is_truthy(values: pd.Series) -> pd.Series:
+    """bool(x) for every value (NaN counts as truthy, as it does in an `if`)."""
+    return values.map(bool).astype(bool)
+
+
+def fill_geo_loc_name(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Fills in "*geo_loc_name" from "Locality Description", "State" and "County" for every sample at once.
+
+    Gives the same result as the old per-row decision tree in generate_TSV:
+        - no geo_loc_name and no Locality Description: "USA: <State>: <County>", "USA: <State>" when County
+          is NaN, or "missing" when State (or both) are blank.
+        - no geo_loc_name: the Locality Description.
+        - both set: "<geo_loc_name>:<Locality Description>".
+    df is modified in place and returned.
+    """
+    geo = _column(df, "*geo_loc_name").astype(object)
+    locality = _column(df, "Locality Description").astype(object)
+    county, state = _column(df, "County"), _column(df, "State")
+    blank_geo, blank_locality = is_blank(geo), is_blank(locality)
+    blank_county, blank_state = is_blank(county), is_blank(state)
+    geo_set, locality_set, county_set = is_truthy(geo), is_truthy(locality), is_truthy(county)
+
+    no_location = blank_geo & blank_locality
+    rule = np.select(
+        [
+            no_location & blank_county & blank_state,
+            no_location & blank_county & county_set,
+            no_location & blank_state & county_set,
+            no_location & county_set,
+            ~no_location & geo_set & blank_locality,
+            ~no_location & blank_geo & locality_set,
+            ~no_location & geo_set & locality_set,
+        ],
+        ["missing", "state", "missing", "state_county", "keep", "locality", "geo_locality"],
+        default="keep",
+    )
+
+    geo_loc_name = geo.copy()
+    geo_loc_name[rule == "missing"] = "missing"
+    rows = rule == "state"
+    geo_loc_name[rows] = "USA: " + state[rows].astype(str)
+    rows = rule == "state_county"
+    geo_loc_name[rows] = "USA: " + state[rows].astype(str) + ": " + county[rows].astype(str)
+    rows = rule == "locality"
+    geo_loc_name[rows] = locality[rows]
+    rows = rule == "geo_locality"
+    geo_loc_name[rows] = geo[rows] + ":" + locality[rows]
+    df["*geo_loc_name"] = geo_loc_name
+    return df
+
+
+def fill_sample_title(df: pd.DataFrame) -> pd.DataFrame:
+    """Uses the minicore sequence id as sample_title where there is none. df is modified in place and returned."""
+    title = _column(df, "sample_title")
+    missing = is_blank(title)
+    df["sample_title"] = title.astype(object).where(~missing, _column(df, "minicore_seq_id"))
+    return df
+
+
+def pair_reads(files) -> list[tuple[str, str]]:
+    """
+    (R1, R2) pairs from one sample's read files, in file name order.
+
+    Files pair up when they differ only in the read token, so each lane (and each differently named set of reads,
+    e.g. samp_a1_R1.fq.gz next to samp_a1_L001_R1.fq.gz) gets its own pair. R1/R2 files without a mate are
+    dropped with a warning. Files with no read token at all are paired in sorted order, as before.
+    """
+    mates, unlabelled = {}, []
+    for name in sorted(files):
+        match = READ_TOKEN.match(name)
+        if match is None:
+            unlabelled.append(name)
+            continue
+        key = (name[: match.start("read")], name[match.end("read") :])
+        mates.setdefault(key, {})[match["read"]] = name
+
+    pairs, unpaired = [], []
+    for reads in mates.values():
+        if len(reads) == 2:
+            pairs.append((reads["1"], reads["2"]))
+        else:
+            unpaired.extend(reads.values())
+    pairs.extend(zip(unlabelled[0::2], unlabelled[1::2]))
+    if len(unlabelled) % 2:
+        unpaired.append(unlabelled[-1])
+    if unpaired:
+        logging.warning(f"No mate found for {len(unpaired)} read file(s), skipping: {', '.join(sorted(unpaired))}")
+    return sorted(pairs)
+
+
+def explode_read_pairs(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per read pair of every sample, with "filename", "filename2" and "library_ID" added.
+
+    Rows are expanded with DataFrame.explode, so the other columns are shared rather than copied. Samples whose
+    "files" is not a list (or that have no "files" column at all) are dropped.
+    """
+    files = _column(df, "files")
+    has_reads = files.map(lambda files: isinstance(files, list)).to_numpy(dtype=bool)
+    out = df[has_reads].copy()
+    out["filename"] = pd.Series([pair_reads(reads) for reads in files[has_reads]], index=out.index, dtype=object)
+    out = out.explode("filename")
+    out = out[out["filename"].notna()]
+    pairs = out["filename"].astype(object)  # Object even when empty, so .str works.
+    out["filename"] = pairs.str[0]
+    out["filename2"] = pairs.str[1]
+    out["library_ID"] = out["filename"].astype(object).str.split("_R1").str[0]
+    return out.reset_index(drop=True)
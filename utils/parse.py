@@ -9,64 +9,15 @@ from pathlib import Path
 from collections import defaultdict
 from gsheets import WGSTracking
 import numpy as np
+import openpyxl
 import re
 import string
 
-
-def split_lat(s):
-    if not isinstance(s, str):
-        return s
-    s = "".join(x for x in s if x not in string.ascii_letters)
-    if len(s.split(",")) == 2:  # Case: s="32.11,128.11"
-        return s.split(",")[0]
-    elif len(s.split(" ")) == 4:  # Case: s="38.05104 N 120.62301 W"
-        return s.split(" ")[0]
-    elif len(s.split("_")) == 2:
-        return s.split("_")[0]
-    print(s)
-
-
-def split_long(s):
-    if not isinstance(s, str):
-        return s
-    s = "".join(x for x in s if x not in string.ascii_letters)
-    if len(s.split(",")) == 2:  # Case: s="32.11,128.11"
-        return s.split(",")[1]
-    elif len(s.split(" ")) == 4:  # Case: s="38.05104 N 120.62301 W"
-        return s.split(" ")[2]
-    elif len(s.split("_")) == 2:
-        return s.split("_")[1]
-    print(s)
-
-
-# https://stackoverflow.com/questions/33997361
-def dms2dd(s):
-    # example: s = """0°51'56.29"S"""
-    chars = ["°", "'", '"']
-    s = str(s)
-    if any(d in s for d in chars):
-        try:
-            split_string = re.split("[°'\"]+", s)
-            if len(split_string) == 4:
-                degrees, minutes, seconds, direction = split_string
-                dd = float(degrees) + float(minutes) / 60 + float(seconds) / (60 * 60)
-                if direction in ("S", "W"):
-                    dd *= -1
-                return dd
-            elif len(split_string) == 3:
-                degrees, minutes, direction = split_string
-                dd = float(degrees) + float(minutes) / (60)
-                if direction in ("S", "W"):
-                    dd *= -1
-                return dd
-        except ValueError:
-            print(f"DMS coordinates malformed: {s}")
-            return 0
-    else:
-        compass = ["N", "S", "E", "W"]
-        for c in compass:
-            str(s).upper().replace(c, "")
-        return s
+PROJECT_IDS = Path(__file__).parent / "project_ids_species.csv"
+HEADER_SEARCH_ROWS = 1000  # How far down an Excel submission the "*sample_name" header is looked for.
+# Part of the SheetCache key of every parsed sheet: bump it whenever a change here alters what a sheet parses to,
+# so cached sheets are parsed again.
+PARSER_VERSION = 1
 
 
 def check_date(date):
@@ -83,63 +34,183 @@ def check_date(date):
     return date
 
 
-def check_lat(lat):
-    lat = float(lat)
-    if lat == 0.0:
-        return 0.0
-    else:
-        if lat > 0:
-            return lat
-        else:
-            return lat * -1
+# Coordinates are parsed a whole column at a time with NumPy string ufuncs.
+ASCII_LETTERS = np.array([ord(letter) for letter in string.ascii_letters], dtype=np.uint32)  # As code points.
+# Forms of "lat_lon" values once ASCII letters are removed, tried in this order: (separator, number of separators,
+# index of the longitude piece).
+LAT_LON_FORMS = (
+    (",", 1, 1),  # "32.11,128.11"
+    (" ", 3, 2),  # "38.05104 N 120.62301 W"
+    ("_", 1, 1),  # "38.05104_-120.62301"
+)
+NUMBER = re.compile(r"\s*[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?\s*")
+
+
+def _to_float(text: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """float(x) for an array of strings: float64 values and a mask of the ones float() accepted (the rest are NaN)."""
+    try:
+        return text.astype("float64"), np.ones(len(text), dtype=bool)
+    except ValueError:
+        pass
+    out = np.full(len(text), np.nan)
+    valid = pd.Series(text, dtype=object).str.fullmatch(NUMBER).to_numpy(dtype=bool)
+    out[valid] = text[valid].astype("float64")
+    for i in np.flatnonzero(~valid):  # Whatever else float() takes, e.g. "inf" or "1_000".
+        try:
+            out[i], valid[i] = float(text[i]), True
+        except ValueError:
+            pass
+    return out, valid
+
+
+def _pieces(text: np.ndarray, sep: str, n: int) -> list[np.ndarray]:
+    """The first n pieces of every string split on sep."""
+    if not len(text):
+        return [text] * n
+    pieces = []
+    for _ in range(n):
+        head, _, text = np.char.partition(text, sep).T
+        pieces.append(head)
+    return pieces
+
+
+def split_lat_lon(lat_lon: pd.Series) -> tuple[pd.Series, pd.Series]:
+    """
+    (lat, long) strings from a column of "lat_lon" values.
+
+    Values that aren't strings are passed through to both; strings in none of the LAT_LON_FORMS give None.
+    """
+    lat = lat_lon.to_numpy(dtype=object, copy=True)
+    long = lat.copy()
+    strings = np.fromiter((isinstance(s, str) for s in lat), dtype=bool, count=len(lat))
+    text = lat[strings].astype(str)
+    for letter in np.intersect1d(text.view(np.uint32), ASCII_LETTERS):  # Only the letters that occur.
+        text = np.char.replace(text, chr(letter), "")
+
+    lat_piece = np.full(len(text), None, dtype=object)
+    long_piece = lat_piece.copy()
+    todo = np.ones(len(text), dtype=bool)
+    for sep, seps, long_at in LAT_LON_FORMS:
+        rows = todo & (np.char.count(text, sep) == seps)
+        pieces = _pieces(text[rows], sep, long_at + 1)
+        lat_piece[rows], long_piece[rows] = pieces[0], pieces[long_at]
+        todo &= ~rows
+    lat[strings], long[strings] = lat_piece, long_piece
+    return pd.Series(lat, index=lat_lon.index), pd.Series(long, index=lat_lon.index)
+
+
+def _parse_dms(text: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Strings containing °, ' or " as decimal degrees and validity, NaN where the parts don't fit."""
+    for mark in "'\"":
+        text = np.char.replace(text, mark, "°")
+    while (np.char.find(text, "°°") >= 0).any():  # Runs of marks split once, as in re.split("[°'\"]+", s).
+        text = np.char.replace(text, "°°", "°")
+    marks = np.char.count(text, "°")
+    out, valid = np.full(len(text), np.nan), np.zeros(len(text), dtype=bool)
+    fits = (marks == 2) | (marks == 3)
+    four = marks[fits] == 3
+    degrees, minutes, third, fourth = _pieces(text[fits], "°", 4)
+    degrees, degrees_ok = _to_float(degrees)
+    minutes, minutes_ok = _to_float(minutes)
+    seconds, seconds_ok = _to_float(np.where(four, third, "0"))
+    direction = np.where(four, fourth, third)
+    dd = degrees + minutes / 60
+    dd = np.where(four, dd + seconds / (60 * 60), dd)
+    dd = np.where((direction == "S") | (direction == "W"), -dd, dd)
+    ok = degrees_ok & minutes_ok & seconds_ok
+    out[fits], valid[fits] = np.where(ok, dd, 0.0), ok
+    return out, valid
+
+
+def parse_degrees(values: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """
+    A column of decimal or degrees-minutes-seconds coordinates as float64 decimal degrees and a validity mask.
+
+    Values are read as decimals unless they contain °, ' or ", in which case they have to be degrees, minutes,
+    optional seconds and a direction (S and W are negative). Values that can't be read are NaN and invalid, except
+    DMS values with a part that isn't a number, which are 0. Missing values are NaN but valid.
+    """
+    if values.dtype.kind in "iuf":
+        return values.to_numpy(dtype="float64"), np.ones(len(values), dtype=bool)
+    text = values.astype(str).to_numpy(dtype=str)
+    is_dms = np.zeros(len(text), dtype=bool)
+    for mark in "°'\"":
+        is_dms |= np.char.find(text, mark) >= 0
+    out, valid = np.full(len(text), np.nan), np.zeros(len(text), dtype=bool)
+    out[~is_dms], valid[~is_dms] = _to_float(text[~is_dms])
+    if is_dms.any():
+        out[is_dms], valid[is_dms] = _parse_dms(text[is_dms])
+    return out, valid
+
+
+def parse_coordinates(lat: pd.Series, long: pd.Series) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Whole lat and long columns as float64 latitudes made positive and longitudes made negative (all CCGP samples
+    are from the northern and western hemispheres), and a mask of rows where both were read.
+    """
+    lat, lat_valid = parse_degrees(lat)
+    long, long_valid = parse_degrees(long)
+    lat = np.abs(lat)
+    long = -np.abs(long)
+    long[long == 0] = 0.0
+    return lat, long, lat_valid & long_valid
+
+
+def report_bad_coordinates(df: pd.DataFrame, valid: np.ndarray) -> None:
+    if not valid.all():
+        print(f"Could not read coordinates of: {df.loc[~valid, '*sample_name'].tolist()}")
+
+
+class ProjectIdResolver:
+    """
+    Looks up the project-id of organism names from project_ids_species.csv.
+
+    The csv is read once and again only when its mtime changes. Each distinct organism string is resolved once,
+    and every new one in a call is matched at the same time: on "Genus species" first, then on the genus alone.
+    """
+
+    def __init__(self, path=PROJECT_IDS) -> None:
+        self.path = Path(path)
+        self.mtime = None
+        self.species, self.genera = {}, {}
+        self.resolved = {}  # organism string -> (project-id, 1 if the species matched else 0)
+
+    def load(self) -> None:
+        mtime = self.path.stat().st_mtime_ns
+        if mtime == self.mtime:
+            return
+        species, genera = {}, {}
+        with open(self.path, "r") as f:
+            next(f)
+            for line in f:
+                line = line.strip().split(",")
+                project_id, genus, subspecies = line[0], line[1], line[2]
+                species[subspecies] = project_id
+                genera[genus] = project_id
+        self.species, self.genera, self.resolved, self.mtime = species, genera, {}, mtime
 
+    def resolve(self, organisms: pd.Series) -> list[list]:
+        """[project-ids, expected-species flags] for the non-null organisms, as get_project_id returns them."""
+        self.load()
+        organisms = organisms.dropna()
+        new = pd.Series(organisms[~organisms.isin(self.resolved.keys())].unique(), dtype=object)
+        if len(new):
+            words = new.str.strip().str.split()
+            name = new.where(words.str.len() < 3, words.str[:2].str.join(" "))  # Only care about genus species.
+            project_ids = name.map(self.species)
+            expected = project_ids.notna().astype(int)
+            project_ids = project_ids.fillna(words.str[0].map(self.genera)).fillna("Unknown project-id")
+            self.resolved.update(zip(new, zip(project_ids, expected.tolist())))
+        pairs = [self.resolved[organism] for organism in organisms]
+        return [[project_id for project_id, _ in pairs], [expected for _, expected in pairs]]
 
-def check_long(long):
-    long = float(long)
-    if long == 0.0:
-        return 0.0
-    else:
-        if long < 0:
-            return long
-        else:
-            return long * -1
+
+_project_ids = ProjectIdResolver()
 
 
 def get_project_id(series: pd.Series) -> dict[str:str]:
     """Takes series of species and looks up what project-id it belongs to and returns that id"""
-
-    def create_dict() -> dict:
-        project_ids = defaultdict(str)
-        genuses = defaultdict(str)
-        with open("project_ids_species.csv", "r") as f:
-            next(f)
-            for line in f:
-                line = line.strip().split(",")
-                project_id, genus, subspecies = line[0], line[1], line[2]
-                project_ids[subspecies] = project_id
-                genuses[genus] = project_id
-        return project_ids, genuses
-
-    series = series.dropna()
-
-    spp_lookup, genus_lookup = create_dict()
-    out = [[], []]
-    for s in series:
-        if len(s.strip().split()) >= 3:
-            s = " ".join(s.strip().split()[:2])  # Only care about genus species.
-        if s in spp_lookup:
-            out[0].append(spp_lookup[s])
-            out[1].append(1)
-        else:  # S was not in subspecies so lets compare genus of S to genus of K
-            g = s.strip().split()[0]
-            if g in genus_lookup:
-                out[0].append(genus_lookup[g])
-                out[1].append(0)
-            else:
-                out[0].append("Unknown project-id")
-                out[1].append(0)
-
-    return out
+    return _project_ids.resolve(series)
 
 
 def find_header_line_num(file: Path) -> int:
@@ -151,6 +222,39 @@ def find_header_line_num(file: Path) -> int:
     raise (ValueError(f"Could not find header in {file}"))
 
 
+def find_excel_header(file: Path, max_rows: int = HEADER_SEARCH_ROWS) -> tuple[int, list[int]]:
+    """
+    Find the row number of the header in the first sheet of an Excel file, and the columns that have a name.
+
+    .xlsx files are streamed with openpyxl and only read up to the header; openpyxl can't open .xls files, so for
+    those the first max_rows rows are read with pandas.
+    """
+    if file.suffix == ".xlsx":
+        wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+        try:
+            rows = wb.worksheets[0].iter_rows(max_row=max_rows, values_only=True)
+            header = next(((i, row) for i, row in enumerate(rows) if "*sample_name" in row), None)
+        finally:
+            wb.close()
+    else:
+        rows = pd.read_excel(file, header=None, nrows=max_rows).itertuples(index=False)
+        header = next(((i, row) for i, row in enumerate(rows) if "*sample_name" in row), None)
+    if header is None:
+        raise (ValueError(f"Could not find header in {file}"))
+    i, row = header
+    return i, [j for j, name in enumerate(row) if not pd.isna(name) and name != ""]
+
+
+def apply_lookups(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Sets the project-id, expected-species and ref_genome_accession of the samples from their "*organism", using
+    project_ids_species.csv and WGSTracking. Sheets loaded from the SheetCache get them again, as both can change.
+    """
+    df["ccgp-project-id"], df["expected-species"] = get_project_id(df["*organism"])
+    df["ref_genome_accession"] = WGSTracking().reference_accession(df["ccgp-project-id"].unique().tolist()[0])
+    return df
+
+
 def read_sheet(file: Path, project_type: str) -> pd.DataFrame:
 
     if project_type == "minicore":
@@ -222,13 +326,9 @@ def read_minicore_sheet(file: Path) -> pd.DataFrame:
 
 def read_non_minicore(file: Path) -> pd.DataFrame:
 
-    w = WGSTracking()
     if file.suffix in [".xlsx", ".xls"]:
-        i = 0
-        df = pd.read_excel(file, header=i)
-        while "*sample_name" not in df.columns:
-            df = pd.read_excel(file, header=i)
-            i += 1
+        header, usecols = find_excel_header(file)
+        df = pd.read_excel(file, header=header, usecols=usecols)
 
     elif file.suffix in [".tsv", ""]:
         df = pd.read_csv(
@@ -236,10 +336,7 @@ def read_non_minicore(file: Path) -> pd.DataFrame:
         )
 
     df.dropna(how="all", inplace=True)
-    df["ccgp-project-id"], df["expected-species"] = get_project_id(df["*organism"])
-    df["ref_genome_accession"] = w.reference_accession(
-        df["ccgp-project-id"].unique().tolist()[0]
-    )
+    df = apply_lookups(df)
     df["metadata_file"] = str(file)
     df["project_type"] = "Non-Minicore"
     if "lat_lon" in df.columns:
@@ -247,21 +344,15 @@ def read_non_minicore(file: Path) -> pd.DataFrame:
         if df["lat_lon"].isna().all():
             df = df.drop(columns=["lat_lon"])
         else:
-            df["lat_lon"] = (
-                df["lat_lon"]
-                .astype(str)
-                .replace("Not determined(.*)", np.nan, regex=True)
-            )
+            df["lat_lon"] = df["lat_lon"].astype(str)
+            df["lat_lon"] = df["lat_lon"].mask(df["lat_lon"].str.contains("Not determined", regex=False))
             # df["lat_lon"] = (
             #     df["lat_lon"].fillna("0,0").astype(str).replace("_", ",", regex=True)  # This is dumb actually.
             # )
             # print(df["lat_lon"])
-            df["lat"] = df["lat_lon"].apply(split_lat)
-            df["long"] = df["lat_lon"].apply(split_long)
+            df["lat"], df["long"] = split_lat_lon(df["lat_lon"])
             df = df.drop(columns=["lat_lon"])
-    df["lat"] = df["lat"].apply(dms2dd)
-    df["long"] = df["long"].apply(dms2dd)
-
+    # Coordinates are parsed, and unreadable ones reported, in finalize_df.
     return df
 
 
@@ -277,8 +368,8 @@ def finalize_df(df: pd.DataFrame) -> pd.DataFrame:
     df["*sample_name"] = df["*sample_name"].str.replace(".", "_")
     # Same for spaces but underscores instead
     df["*sample_name"] = df["*sample_name"].str.replace(" ", "_")
-    df["lat"] = df["lat"].apply(check_lat)
-    df["long"] = df["long"].apply(check_long)
+    df["lat"], df["long"], valid = parse_coordinates(df["lat"], df["long"])
+    report_bad_coordinates(df, valid)
     if "collection_date" in df.columns:
         df["collection_date"] = df["collection_date"].apply(check_date)
     if "collection_date*" in df.columns:
@@ -291,34 +382,67 @@ def finalize_df(df: pd.DataFrame) -> pd.DataFrame:
     return df
 
 
-def get_summary_df(df) -> pd.DataFrame:
+# Per-project counts for the summary tab, one document per project. A sample "has reads" when its files are a list;
+# otherwise they are missing, null or NaN.
+SUMMARY_PIPELINE = [
+    # Same rows as groupby("ccgp-project-id") dropping missing keys: null, NaN and absent ids are left out.
+    {"$match": {"ccgp-project-id": {"$nin": [None, float("nan")]}}},
+    {
+        "$project": {
+            "_id": 0,
+            "ccgp-project-id": 1,
+            "*sample_name": 1,
+            "expected-species": 1,
+            "project_type": 1,
+            # NaN sorts below every other number, so this leaves out NaN as well as nulls and non-numbers.
+            "filesize_sum": {
+                "$cond": [
+                    {"$and": [{"$isNumber": "$filesize_sum"}, {"$gt": ["$filesize_sum", float("-inf")]}]},
+                    "$filesize_sum",
+                    0,
+                ]
+            },
+            "has_files": {"$isArray": "$files"},
+        }
+    },
+    {
+        "$group": {
+            "_id": "$ccgp-project-id",
+            "total_counts": {"$sum": 1},
+            "has_reads": {"$sum": {"$cond": ["$has_files", 1, 0]}},
+            "expected_species": {"$sum": "$expected-species"},
+            "filesize_sum": {"$sum": "$filesize_sum"},
+            "project_types": {"$push": "$project_type"},
+            "files_na": {"$push": {"$cond": ["$has_files", "$$REMOVE", "$*sample_name"]}},
+        }
+    },
+    {"$sort": {"_id": 1}},
+]
+
+
+def _mode(values: list):
+    """What groupby().agg(pd.Series.mode) gives for one group: the mode, or an array of them if there's a tie."""
+    mode = pd.Series(values, dtype=object).mode()
+    return mode.iloc[0] if len(mode) == 1 else mode.to_numpy()
+
+
+def get_summary_df(collection) -> pd.DataFrame:
+    """Summary of every project in the sample_metadata collection, counted by MongoDB rather than in pandas."""
     wgs_sheet = WGSTracking()
 
-    subset = df[
-        [
-            "ccgp-project-id",
-            "files",
-            "filesize_sum",
-            "*sample_name",
-            "*organism",
-            "expected-species",
-            "project_type",
-        ]
-    ]
-    subset["expected-species"] = subset["expected-species"].astype(int)
-    grouped = subset.groupby("ccgp-project-id")
-    total_counts = grouped.size()
-    has_reads = grouped["files"].count()
+    projects = pd.DataFrame(list(collection.aggregate(SUMMARY_PIPELINE)))
+    projects = projects.set_index("_id").rename_axis("ccgp-project-id")
+    total_counts = projects["total_counts"]
+    has_reads = projects["has_reads"]
 
-    expected_species = total_counts - (grouped["expected-species"].sum() / 1)
-    filesize_sum = grouped["filesize_sum"].sum() / 1e12
+    expected_species = total_counts - (projects["expected_species"] / 1)
+    filesize_sum = projects["filesize_sum"] / 1e12
     reference_prog = wgs_sheet.reference_progress()
     expected_count = wgs_sheet.expected_count()
     percent_seq = has_reads / expected_count
 
-    project_type = grouped["project_type"].agg(pd.Series.mode)
-    files_na = subset[subset["files"].isna()]
-    files_na = files_na.groupby("ccgp-project-id")["*sample_name"].apply(list)
+    project_type = projects["project_types"].map(_mode)
+    files_na = projects["files_na"][projects["files_na"].str.len() > 0]
 
     df = pd.concat(
         {
@@ -0,0 +1,100 @@
+"""On-disk Parquet cache of parsed submission sheets, so unchanged sheets aren't downloaded and parsed again."""
+import hashlib
+import json
+import os
+from os import getenv
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from dotenv import load_dotenv
+
+DEFAULT_CACHE = Path(__file__).parent / "sheet_cache"
+DEFAULT_MAX_BYTES = 2 * 1024**3
+# Schema metadata key of {column: row positions} of the None values in object columns.
+NONES_KEY = b"sheet_cache_nones"
+
+
+class SheetCache:
+    """
+    Parquet files of finalized sheet DataFrames, one per (Drive file id, modifiedTime, project type, version).
+
+    A Drive file that is edited gets a new modifiedTime and so a new key; entries of old versions are never read
+    again and age out. Parquet stores both None and NaN in object columns as null, so put() records where the
+    Nones were and get() gives back NaN everywhere else, as the parsed frame had them. Reads bump an entry's mtime, and evict() drops the least recently used entries until the
+    cache fits in max_bytes.
+    """
+
+    def __init__(self, path=None, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        load_dotenv()
+        self.path = Path(path or getenv("sheet_cache") or DEFAULT_CACHE)
+        self.max_bytes = max_bytes
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(file: dict, project_type: str, version="") -> str:
+        """
+        Cache key of a Drive file as listed by CCGPDrive (needs "id" and "modifiedTime"). version is anything else
+        the parsed sheet depends on, e.g. the mtime of a lookup table, so entries made before it changed are missed.
+        """
+        return hashlib.sha256(
+            f"{file['id']}:{file['modifiedTime']}:{project_type}:{version}".encode()
+        ).hexdigest()
+
+    def _entry(self, key: str) -> Path:
+        return self.path / f"{key}.parquet"
+
+    def get(self, key: str):
+        """The cached DataFrame for key, or None. The file is memory-mapped rather than read into a buffer first."""
+        entry = self._entry(key)
+        try:
+            table = pq.read_table(entry, memory_map=True)
+        except (FileNotFoundError, pa.ArrowInvalid):
+            return None
+        os.utime(entry)
+        nones = json.loads((table.schema.metadata or {}).get(NONES_KEY, b"{}"))
+        df = table.to_pandas()
+        for i in np.flatnonzero((df.dtypes == object).to_numpy()):
+            values = df.iloc[:, i].to_numpy(copy=True)
+            values[pd.isna(values)] = np.nan
+            values[nones.get(str(df.columns[i]), [])] = None
+            df.isetitem(i, values)
+        return df
+
+    def put(self, key: str, df: pd.DataFrame) -> bool:
+        """
+        Stores df under key. Returns False if it can't be stored as Parquet, e.g. because a column mixes numbers
+        and strings; such sheets are simply parsed again next time.
+        """
+        entry = self._entry(key)
+        tmp = entry.with_name(f"{entry.name}.{os.getpid()}.tmp")
+        nones = {
+            str(column): [i for i, value in enumerate(values) if value is None]
+            for column, values in df.items()
+            if values.dtype == object
+        }
+        try:
+            table = pa.Table.from_pandas(df)
+            table = table.replace_schema_metadata(
+                {**table.schema.metadata, NONES_KEY: json.dumps({c: rows for c, rows in nones.items() if rows})}
+            )
+            pq.write_table(table, tmp)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, ValueError, TypeError):
+            tmp.unlink(missing_ok=True)
+            return False
+        os.replace(tmp, entry)
+        return True
+
+    def evict(self) -> None:
+        """Drops the least recently used entries until the cache is no bigger than max_bytes."""
+        entries = sorted(
+            ((entry.stat(), entry) for entry in self.path.glob("*.parquet")), key=lambda item: item[0].st_mtime
+        )
+        total = sum(stat.st_size for stat, _ in entries)
+        for stat, entry in entries:
+            if total <= self.max_bytes:
+                break
+            entry.unlink(missing_ok=True)
+            total -= stat.st_size
@@ -1,26 +1,22 @@
-import boto3
+import sys
+sys.path.append(
+    ".."
+)
 import argparse
 import pymongo
-from dotenv import load_dotenv
-from os import getenv
 import os
 from pathlib import Path
+from utils.inventory import S3Inventory
 
 
 
 def get_aws_files():
 
-    load_dotenv()
-    s3 = boto3.resource(
-        "s3",
-        aws_access_key_id=getenv("aws_access_key_id"),
-        aws_secret_access_key=getenv("aws_secret_access_key"),
-        endpoint_url=getenv("endpoint_url"),
-    )
-    bucket = s3.Bucket("ccgp")
+    inventory = S3Inventory()
+    inventory.refresh()
 
     bucket_list = []
-    for obj in bucket.objects.all():
+    for obj in inventory.objects():
         bucket_list.append(obj.key)
 
 
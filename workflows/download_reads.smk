@@ -79,7 +79,11 @@ checkpoint checksums:
         return True
         
 rule sync:
-    """Syncs to AWS s3 bucket """
+    """
+    Syncs to AWS s3 bucket and marks the synced keys as changed in the S3 inventory. Synced keys can sort before
+    the inventory's cursors, so if marking them fails the rule fails too, rather than leaving them out of the
+    inventory until the next full sync.
+    """
     input:
         ancient("downloads/{name}/checksums_done")
     output:
@@ -87,7 +91,10 @@ rule sync:
     params:
         dl_dir = "downloads/{name}"
     shell:
-        "aws s3 sync {params.dl_dir}/ s3://ccgp --endpoint=http://10.50.1.41:7480/"
+        """
+        aws s3 sync {params.dl_dir}/ s3://ccgp --endpoint=http://10.50.1.41:7480/
+        python3 ../utils/inventory.py mark-changed $(ls {params.dl_dir})
+        """
 
 
 rule fastqc:
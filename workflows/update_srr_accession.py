@@ -8,26 +8,18 @@ import os
 import csv
 import time
 from utils.db import get_mongo_client
-from dotenv import load_dotenv
-from os import getenv
-import boto3
+from utils.indexes import ensure_indexes
+from utils.inventory import S3Inventory
 
 """
 This script is designed to intake processed NCBI metadata & assign it to the MongoDB "reads" collection.
 """
 
 def list_s3_bucket_objs():
-    """Returns s3 objectCollection"""
-    load_dotenv()
-    s3 = boto3.resource(
-        "s3",
-        aws_access_key_id=getenv("aws_access_key_id"),
-        aws_secret_access_key=getenv("aws_secret_access_key"),
-        endpoint_url=getenv("endpoint_url"),
-    )
-    bucket = s3.Bucket("ccgp")
-    objects = bucket.objects.all()
-    aws_bucket = {obj.key: obj.size for obj in objects}
+    """Returns {key: size} for the ccgp bucket from the local S3 inventory."""
+    inventory = S3Inventory()
+    inventory.refresh()
+    aws_bucket = {obj.key: obj.size for obj in inventory.objects()}
     return aws_bucket
 
 already_processed = []
@@ -103,6 +95,7 @@ def main():
     aws_files = list_s3_bucket_objs()
     client = get_mongo_client()
     db = client["ccgp_dev"]
+    ensure_indexes(db)
     collection = db["reads"]
 
     accession_sheets_folder = "update_accession_sheets"